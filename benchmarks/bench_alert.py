@@ -0,0 +1,103 @@
+"""Benchmark the reddit_alert keyword matchers.
+
+Each matcher in ``prawtools.matching`` is built for a synthetic keyword list
+and then scans synthetic comments, a fraction of which contain a keyword.
+No requests are made to reddit.
+
+Run from the repository root, for instance:
+
+    python benchmarks/bench_alert.py --keywords 10,1000,50000 -o out.json
+
+"""
+from __future__ import print_function
+from optparse import OptionParser
+import json
+import os
+import platform
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from prawtools import __version__  # noqa: E402
+from prawtools.matching import MATCHERS  # noqa: E402
+
+
+def word(rand):
+    """Return a random lowercase word."""
+    return ''.join(rand.choice(string.ascii_lowercase)
+                   for _ in range(rand.randint(3, 10)))
+
+
+def generate(num_keywords, num_comments, seed):
+    """Return a tuple (keywords, comments) of synthetic data."""
+    rand = random.Random(seed)
+    keywords = set()
+    while len(keywords) < num_keywords:
+        keywords.add(' '.join(word(rand) for _ in range(rand.randint(1, 2))))
+    keywords = sorted(keywords)
+    comments = []
+    for _ in range(num_comments):
+        words = [word(rand) for _ in range(rand.randint(5, 80))]
+        if rand.random() < 0.05:
+            words.insert(rand.randint(0, len(words)), rand.choice(keywords))
+        comments.append(' '.join(words).capitalize() + '.')
+    return keywords, comments
+
+
+def run(name, keywords, comments):
+    """Return the build time, scan time and number of matching comments."""
+    start = time.time()
+    matcher = MATCHERS[name](keywords)
+    built = time.time()
+    matched = sum(1 for comment in comments if matcher.find_all(comment))
+    return {'build_seconds': built - start, 'comments': len(comments),
+            'keywords': len(keywords), 'matched': matched, 'matcher': name,
+            'scan_seconds': time.time() - built}
+
+
+def main():
+    """Provide the entry point to the benchmark."""
+    parser = OptionParser(usage='usage: %prog [options]')
+    parser.add_option('', '--comments', type='int', default=2000,
+                      help='The number of comments to scan [default %default]')
+    parser.add_option('', '--keywords', default='10,1000,50000',
+                      help=('Comma separated numbers of keywords '
+                            '[default %default]'))
+    parser.add_option('', '--matcher', action='append',
+                      choices=sorted(MATCHERS),
+                      help='The matcher(s) to benchmark [default: all]')
+    parser.add_option('-o', '--output', metavar='FILE',
+                      help='Write the JSON results to FILE [default: stdout]')
+    parser.add_option('', '--seed', type='int', default=0,
+                      help='The random seed [default %default]')
+    options, _ = parser.parse_args()
+
+    results = []
+    for num_keywords in (int(x) for x in options.keywords.split(',')):
+        keywords, comments = generate(num_keywords, options.comments,
+                                      options.seed)
+        for name in options.matcher or sorted(MATCHERS):
+            result = run(name, keywords, comments)
+            results.append(result)
+            print('{:>6} keywords {:<9} build={:.3f}s scan={:.3f}s '
+                  '({:.0f} comments/s)'.format(
+                      num_keywords, name, result['build_seconds'],
+                      result['scan_seconds'], len(comments) / max(
+                          result['scan_seconds'], 1e-9)), file=sys.stderr)
+
+    document = {'prawtools': __version__, 'python': platform.python_version(),
+                'results': results, 'seed': options.seed}
+    if options.output:
+        with open(options.output, 'w') as fp:
+            json.dump(document, fp, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(document, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""Benchmark how subreddit_stats reclaims the memory of comment trees.
+
+Synthetic PRAW comment trees, with the same reference cycles as fetched
+ones, are processed by ``SubredditStats.process_commenters`` using either:
+
+* ``adaptive``: trees are released as soon as they are condensed and a full
+  garbage collection only runs once the process has grown significantly.
+* ``per_tree``: trees are left to the garbage collector and a full
+  collection runs after every tree, as prawtools used to do.
+
+Each strategy runs in its own process so that peak resident sizes are
+comparable. No requests are made to reddit.
+
+Run from the repository root, for instance:
+
+    python benchmarks/bench_gc.py --submissions 1000,4000 -o out.json
+
+"""
+from __future__ import print_function
+from optparse import OptionParser
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from praw import Reddit  # noqa: E402
+from praw.models import Comment  # noqa: E402
+from praw.models.comment_forest import CommentForest  # noqa: E402
+
+from prawtools import __version__, stats  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+STRATEGIES = ('adaptive', 'per_tree')
+
+
+class PerTreeCollector(stats.AdaptiveCollector):
+    """A collector that is always due, as prawtools used to behave."""
+
+    def due(self):
+        """Return True."""
+        return True
+
+
+def build_tree(reddit, submission_id, size, num_authors, rand):
+    """Return a flattened PRAW comment tree of ``size`` comments."""
+    submission = reddit.submission(id=submission_id)
+    comments = []
+    replies = {None: []}
+    for index in range(size):
+        comment = Comment(reddit, _data={
+            'author': 'user{}'.format(int(num_authors * rand.random() ** 3)),
+            'body': 'Synthetic comment body ' * 4,
+            'created_utc': 1500000000 + rand.random() * 86400,
+            'distinguished': None,
+            'id': '{}c{}'.format(submission_id, index),
+            'name': 't1_{}c{}'.format(submission_id, index),
+            'score': int(rand.expovariate(0.2))})
+        comment.submission = submission
+        parent = None
+        if comments and rand.random() < 0.7:
+            parent = rand.choice(comments).id
+        replies.setdefault(parent, []).append(comment)
+        comments.append(comment)
+    for comment in comments:
+        comment._replies = CommentForest(submission,
+                                         replies.get(comment.id, []))
+    submission._comments = CommentForest(submission, replies[None])
+    return comments
+
+
+def run(strategy, num_submissions, num_authors, seed):
+    """Return the results of processing synthetic trees with a strategy."""
+    reddit = Reddit(client_id='benchmark', client_secret=None,
+                    check_for_updates=False, user_agent='prawtools benchmark')
+    srs = stats.SubredditStats('benchmark', None, False, reddit=reddit)
+    if strategy == 'per_tree':
+        srs.collector = PerTreeCollector()
+        stats._release_tree = lambda comments: None
+
+    rand = random.Random(seed)
+    for index in range(num_submissions):
+        submission = stats.MiniSubmission(stats.SubmissionRecord(
+            author='user{}'.format(index % 100), created_utc=1500000000,
+            distinguished=None, id='s{}'.format(index),
+            num_comments=rand.randint(1, 80), permalink='',
+            score=1, title='Synthetic submission', url=''))
+        srs.submissions[submission.id] = submission
+
+    def fetch(submission):
+        return build_tree(reddit, submission.id, submission.num_comments,
+                          num_authors, rand)
+    srs._fetch_comment_tree = fetch
+
+    start = time.time()
+    srs.process_commenters()
+    return {'collections': srs.collector.collections,
+            'comments': srs.comment_stats.count,
+            'peak_rss_bytes': (resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss * 1024 if resource else None),
+            'seconds': time.time() - start, 'strategy': strategy,
+            'submissions': num_submissions}
+
+
+def main():
+    """Provide the entry point to the benchmark."""
+    parser = OptionParser(usage='usage: %prog [options]')
+    parser.add_option('', '--authors', type='int', default=50000,
+                      help='The number of distinct authors [default %default]')
+    parser.add_option('', '--child', metavar='STRATEGY', choices=STRATEGIES,
+                      help='Run a single strategy and print its result.')
+    parser.add_option('-o', '--output', metavar='FILE',
+                      help='Write the JSON results to FILE [default: stdout]')
+    parser.add_option('', '--seed', type='int', default=0,
+                      help='The random seed [default %default]')
+    parser.add_option('', '--submissions', default='1000,4000',
+                      help=('Comma separated numbers of submissions '
+                            '[default %default]'))
+    options, _ = parser.parse_args()
+
+    if options.child:
+        print(json.dumps(run(options.child, int(options.submissions),
+                             options.authors, options.seed)))
+        return 0
+
+    results = []
+    for num_submissions in options.submissions.split(','):
+        for strategy in STRATEGIES:
+            output = subprocess.check_output([
+                sys.executable, os.path.abspath(__file__), '--child',
+                strategy, '--submissions', num_submissions, '--authors',
+                str(options.authors), '--seed', str(options.seed)])
+            result = json.loads(output.decode('utf-8'))
+            results.append(result)
+            print('{:>6} submissions {:<9} {:.3f}s peak_rss={:.1f}MiB '
+                  'collections={}'.format(
+                      int(num_submissions), strategy, result['seconds'],
+                      (result['peak_rss_bytes'] or 0) / 1048576.,
+                      result['collections']), file=sys.stderr)
+
+    document = {'prawtools': __version__, 'python': platform.python_version(),
+                'results': results, 'seed': options.seed}
+    if options.output:
+        with open(options.output, 'w') as fp:
+            json.dump(document, fp, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(document, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""Benchmark the subreddit_stats aggregation and rendering hot paths.
+
+Synthetic submissions and comments, with a skewed distribution of authors
+and of comments per submission, are folded into a SubredditStats instance
+and every stage of the report is timed. No requests are made to reddit.
+
+Run from the repository root, for instance:
+
+    python benchmarks/bench_stats.py --sizes 10000,1000000,10000000 -o out.json
+
+The output is a JSON document meant to be compared across versions.
+
+"""
+from __future__ import print_function
+from optparse import OptionParser
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from praw import Reddit  # noqa: E402
+
+from prawtools import __version__  # noqa: E402
+from prawtools.cache import CachedComment  # noqa: E402
+from prawtools.stats import (MiniComment, MiniSubmission,  # noqa: E402
+                             SubmissionRecord, SubredditStats, numpy)
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+
+COMMENTS_PER_SUBMISSION = 40
+COMMENTS_PER_AUTHOR = 20
+PERIOD = 30 * 24 * 60 * 60
+START = 1500000000
+
+
+class BenchmarkStats(SubredditStats):
+    """A SubredditStats that never saves nor submits its report."""
+
+    @staticmethod
+    def _save_report(title, body):
+        pass
+
+
+def author(rand, num_authors, deleted=0.05):
+    """Return an author name where low numbered authors are more common."""
+    if rand.random() < deleted:
+        return None
+    return 'user{}'.format(int(num_authors * rand.random() ** 3))
+
+
+def populate(srs, size, seed):
+    """Fold ``size`` synthetic comments into ``srs``.
+
+    Comment trees are generated one submission at a time so that the
+    population itself does not need to fit in memory.
+
+    """
+    rand = random.Random(seed)
+    num_authors = max(10, size // COMMENTS_PER_AUTHOR)
+    num_submissions = max(1, size // COMMENTS_PER_SUBMISSION)
+
+    counts = [0] * num_submissions
+    for _ in range(size):
+        counts[int(num_submissions * rand.random() ** 2)] += 1
+
+    for index, count in enumerate(counts):
+        created = START + rand.random() * PERIOD
+        submission = MiniSubmission(SubmissionRecord(
+            author=author(rand, num_authors // 10 + 1),
+            created_utc=created, distinguished=None,
+            id='s{}'.format(index), num_comments=count,
+            permalink='/r/benchmark/comments/s{}/_/'.format(index),
+            score=int(rand.expovariate(0.01)),
+            title='Synthetic submission {}'.format(index),
+            url='https://example.com/{}'.format(index)))
+        srs.submissions[submission.id] = submission
+        srs.comment_stats.extend([MiniComment(CachedComment(
+            author=author(rand, num_authors),
+            created_utc=created + rand.random() * 86400, distinguished=None,
+            id='s{}c{}'.format(index, i),
+            score=int(rand.expovariate(0.2)) - 1), submission)
+            for i in range(count)])
+
+    srs.min_date = START
+    srs.max_date = START + PERIOD
+    srs.process_submitters()
+
+
+def measure(function, memory, repeat=1):
+    """Return (seconds, peak traced bytes or None) of calling ``function``.
+
+    The fastest of ``repeat`` calls is reported.
+
+    """
+    best = peak = None
+    for _ in range(repeat):
+        gc.collect()
+        if memory:
+            tracemalloc.start()
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if memory:
+            peak = max(peak or 0, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        best = elapsed if best is None else min(best, elapsed)
+    return best, peak
+
+
+def run(size, backend, submitters, memory, repeat, seed):
+    """Return the results of benchmarking a single population."""
+    reddit = Reddit(client_id='benchmark', client_secret=None,
+                    check_for_updates=False, user_agent='prawtools benchmark')
+    srs = BenchmarkStats('benchmark', None, False, reddit=reddit,
+                         columnar=backend == 'columnar')
+    stages = {}
+
+    def record(name, function, stage_repeat=repeat):
+        seconds, peak = measure(function, memory, stage_repeat)
+        stages[name] = {'peak_bytes': peak, 'seconds': seconds}
+
+    record('aggregate', lambda: populate(srs, size, seed), 1)
+    record('basic_stats', srs.basic_stats)
+    record('top_submitters', lambda: srs.top_submitters(submitters))
+    record('top_commenters', lambda: srs.top_commenters(submitters))
+    record('top_submissions', srs.top_submissions)
+    record('top_comments', srs.top_comments)
+    record('publish_results',
+           lambda: srs.publish_results('30', submitters, submitters,
+                                       submit=False))
+    return {'backend': backend, 'comments': srs.comment_stats.count,
+            'commenters': len(srs.comment_stats.authors), 'size': size,
+            'stages': stages, 'submissions': len(srs.submissions)}
+
+
+def main():
+    """Provide the entry point to the benchmark."""
+    parser = OptionParser(usage='usage: %prog [options]')
+    parser.add_option('', '--sizes', default='10000,100000,1000000',
+                      help=('Comma separated numbers of comments to generate '
+                            '[default %default]'))
+    parser.add_option('', '--backend', action='append',
+                      choices=('columnar', 'dict'),
+                      help=('The CommentStats backend(s) to benchmark '
+                            '[default: dict, and columnar when numpy is '
+                            'available]'))
+    parser.add_option('', '--no-memory', action='store_true',
+                      help='Do not trace peak memory usage with tracemalloc.')
+    parser.add_option('-o', '--output', metavar='FILE',
+                      help='Write the JSON results to FILE [default: stdout]')
+    parser.add_option('', '--repeat', type='int', default=3,
+                      help=('Report the fastest of N runs of each rendering '
+                            'stage [default %default]'))
+    parser.add_option('', '--seed', type='int', default=0,
+                      help='The random seed [default %default]')
+    parser.add_option('', '--submitters', type='int', default=1000,
+                      help=('The number of top submitters and commenters to '
+                            'render [default %default]'))
+    options, _ = parser.parse_args()
+
+    backends = options.backend or (['dict', 'columnar'] if numpy else
+                                   ['dict'])
+    memory = tracemalloc is not None and not options.no_memory
+    results = []
+    for size in (int(x) for x in options.sizes.split(',')):
+        for backend in backends:
+            result = run(size, backend, options.submitters, memory,
+                         options.repeat, options.seed)
+            results.append(result)
+            print('{:>9} {:<8} {}'.format(size, backend, ' '.join(
+                '{}={:.3f}s'.format(name, stage['seconds'])
+                for name, stage in sorted(result['stages'].items()))),
+                file=sys.stderr)
+
+    document = {'prawtools': __version__, 'python': platform.python_version(),
+                'results': results, 'seed': options.seed,
+                'tracemalloc': memory}
+    if options.output:
+        with open(options.output, 'w') as fp:
+            json.dump(document, fp, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(document, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
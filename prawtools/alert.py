@@ -4,13 +4,32 @@ This command will alert you when chosen keywords appear in reddit comments.
 
 """
 from __future__ import print_function
-
-import re
+from collections import Counter, OrderedDict, namedtuple
+import itertools
+import multiprocessing
+import signal
 import sys
+import threading
+import time
 
 import praw
+from six.moves import map, queue
 
+from .checkpoint import AlertCheckpoint
 from .helpers import AGENT, arg_parser, check_for_updates
+from .matching import MATCHERS, RegexMatcher, load_keywords
+from .metrics import Histogram, metric, serve_metrics, write_metrics
+from .rules import RuleSet, load_rules
+
+
+CommentInfo = namedtuple('CommentInfo', ['author', 'body', 'id', 'link_id',
+                                         'subreddit'])
+
+MAX_MULTIREDDIT = 100  # Watch r/all and filter when there are more subreddits
+MESSAGE_LIMIT = 10000  # The maximum length of a reddit message body
+SUBJECT_LIMIT = 100  # The maximum length of a reddit message subject
+
+_matcher = None  # The keyword matcher of the current (matcher) process
 
 
 def quick_url(comment):
@@ -18,8 +37,523 @@ def quick_url(comment):
     def to_id(fullname):
         return fullname.split('_', 1)[1]
     return ('http://www.reddit.com/r/{}/comments/{}/_/{}?context=3'
-            .format(comment.subreddit.display_name, to_id(comment.link_id),
-                    comment.id))
+            .format(comment.subreddit, to_id(comment.link_id), comment.id))
+
+
+def backfill(subreddit, checkpoint):
+    """Return the comments of subreddit missed since the checkpoint.
+
+    The comments are returned oldest first. Reddit lists at most about 1000
+    comments, so a longer gap cannot be fully recovered.
+
+    """
+    if not checkpoint.last:
+        return []
+    missed = []
+    for comment in subreddit.comments(limit=None):
+        if comment.id in checkpoint.seen or \
+                comment.fullname == checkpoint.last:
+            break
+        missed.append(comment)
+    else:
+        sys.stderr.write('Could not backfill all comments since {}\n'
+                         .format(checkpoint.last))
+    missed.reverse()
+    return missed
+
+
+def _init_matcher(matcher_class, keywords, ignore_interrupt=False):
+    global _matcher
+    if ignore_interrupt:  # Let the parent process handle Ctrl-C
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _matcher = matcher_class(keywords)
+
+
+def _match(comment):
+    """Return a tuple (comment, list of matched keywords, seconds taken)."""
+    start = time.time()
+    keywords = _matcher.find_all(comment.body)
+    return comment, keywords, time.time() - start
+
+
+class DigestNotifier(object):
+    """Buffer alerts per recipient and send them as digest messages.
+
+    A recipient's buffered alerts are sent as a single message, grouped by
+    keyword, once ``size`` alerts are buffered or once the oldest buffered
+    alert is ``interval`` seconds old. Messages are sent from a background
+    thread so that adding an alert never waits on message delivery.
+
+    """
+
+    def __init__(self, reddit, size=50, interval=300, checkpoint=None):
+        """Initialize a DigestNotifier and start its sender thread.
+
+        :param reddit: The Reddit instance used to send the messages.
+        :param size: The number of alerts that triggers sending a digest.
+        :param interval: The maximum number of seconds an alert is buffered.
+        :param checkpoint: When provided, the AlertCheckpoint in which the
+            comments of the alerts are only recorded as processed once their
+            digest was sent.
+
+        """
+        self.checkpoint = checkpoint
+        self.failed = 0
+        self.interval = interval
+        self.reddit = reddit
+        self.sent = 0
+        self.size = size
+        self._buffers = {}
+        self._digests = queue.Queue()
+        self._lock = threading.Lock()
+        self._since = {}
+        self._thread = threading.Thread(target=self._send_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @staticmethod
+    def format(alerts):
+        """Return the (subject, body) of a message for a list of alerts.
+
+        :param alerts: A list of (comment, keywords) tuples.
+
+        """
+        if len(alerts) == 1:
+            comment, keywords = alerts[0]
+            return ('Reddit Alert: {}'.format(', '.join(keywords)),
+                    '{}\n\nby /u/{}\n\n---\n\n{}'.format(
+                        quick_url(comment), comment.author, comment.body))
+
+        by_keyword = OrderedDict()
+        for comment, keywords in alerts:
+            for keyword in keywords:
+                by_keyword.setdefault(keyword, []).append(comment)
+        subject = 'Reddit Alert: {} matches for {}'.format(
+            len(alerts), ', '.join(by_keyword))
+
+        body = ''
+        omitted = 0
+        for keyword, comments in by_keyword.items():
+            section = '**{}** ({} match{})\n\n'.format(
+                keyword, len(comments), 'es' if len(comments) != 1 else '')
+            for comment in comments:
+                entry = '* {} by /u/{}\n'.format(quick_url(comment),
+                                                 comment.author)
+                if len(body + section + entry) > MESSAGE_LIMIT - 50:
+                    omitted += 1
+                else:
+                    section += entry
+            body += section + '\n'
+        if omitted:
+            body += '...and {} more'.format(omitted)
+        if len(subject) > SUBJECT_LIMIT:
+            subject = subject[:SUBJECT_LIMIT - 3] + '...'
+        return subject, body
+
+    def _flush(self, recipient):
+        """Queue the buffered alerts of recipient. Requires the lock."""
+        alerts = self._buffers.pop(recipient, None)
+        self._since.pop(recipient, None)
+        if alerts:
+            self._digests.put((recipient, alerts))
+
+    def _send(self, recipient, alerts):
+        subject, body = self.format(alerts)
+        try:
+            self.reddit.redditor(recipient).message(subject, body)
+            self.sent += 1
+        except Exception as error:
+            self.failed += 1
+            sys.stderr.write('Failed to message {}: {!r}\n'.format(
+                recipient, error))
+            return
+        if self.checkpoint:
+            for comment, _ in alerts:
+                self.checkpoint.complete(comment.id)
+
+    def _send_loop(self):
+        while True:
+            # Partial digests that are due are sent ahead of queued digests so
+            # that a busy recipient does not delay the others' digests.
+            now = time.time()
+            with self._lock:
+                due = [(recipient, self._buffers.pop(recipient))
+                       for recipient, since in list(self._since.items())
+                       if now - since >= self.interval]
+                for recipient, _ in due:
+                    del self._since[recipient]
+            for digest in due:
+                self._send(*digest)
+            try:
+                digest = self._digests.get(timeout=min(1, self.interval))
+            except queue.Empty:
+                continue
+            if digest is StopIteration:
+                break
+            self._send(*digest)
+
+    def add(self, recipient, comment, keywords):
+        """Buffer an alert to be sent to recipient."""
+        if self.checkpoint:
+            self.checkpoint.retain(comment.id)
+        with self._lock:
+            if recipient not in self._buffers:
+                self._buffers[recipient] = []
+                self._since[recipient] = time.time()
+            self._buffers[recipient].append((comment, keywords))
+            if len(self._buffers[recipient]) >= self.size:
+                self._flush(recipient)
+
+    def close(self):
+        """Send all buffered alerts and wait for the sender thread to exit."""
+        with self._lock:
+            for recipient in list(self._buffers):
+                self._flush(recipient)
+        self._digests.put(StopIteration)
+        self._thread.join()
+
+    def pending(self):
+        """Return the number of buffered alerts and of unsent digests."""
+        with self._lock:
+            buffered = sum(len(x) for x in self._buffers.values())
+        return buffered, self._digests.qsize()
+
+
+class Prefilter(object):
+    """Drop comments with cheap checks before their bodies are matched.
+
+    The checks run in order from the cheapest: the comment's subreddit, then
+    its author, then the length of its body. Each later check only runs on
+    comments that passed the earlier ones, and ``dropped`` counts the
+    comments eliminated by each check.
+
+    """
+
+    def __init__(self, subreddits=None, exclude_subreddits=None,
+                 ignore_users=None, min_length=0):
+        """Initialize a Prefilter.
+
+        :param subreddits: When provided, the lowercase names of the only
+            subreddits whose comments are kept.
+        :param exclude_subreddits: The lowercase names of subreddits whose
+            comments are dropped.
+        :param ignore_users: The lowercase names of users whose comments are
+            dropped.
+        :param min_length: The minimum length of the body of kept comments.
+
+        """
+        self.dropped = OrderedDict((x, 0) for x in ('subreddit', 'author',
+                                                    'length'))
+        self.exclude_subreddits = frozenset(exclude_subreddits or ())
+        self.ignore_users = frozenset(ignore_users or ())
+        self.min_length = min_length
+        self.subreddits = subreddits and frozenset(subreddits)
+
+    def apply(self, comment):
+        """Return a CommentInfo for comment, or None when it is dropped."""
+        subreddit = comment.subreddit.display_name
+        if self.subreddits or self.exclude_subreddits:
+            lowered = subreddit.lower()
+            if self.subreddits and lowered not in self.subreddits or \
+                    lowered in self.exclude_subreddits:
+                self.dropped['subreddit'] += 1
+                return None
+        author = comment.author.name if comment.author else None
+        if author and self.ignore_users and \
+                author.lower() in self.ignore_users:
+            self.dropped['author'] += 1
+            return None
+        body = comment.body
+        if len(body) < self.min_length:
+            self.dropped['length'] += 1
+            return None
+        return CommentInfo(author, body, comment.id, comment.link_id,
+                           subreddit)
+
+
+class PipelineStats(object):
+    """Track the throughput, latency and backpressure of the alert pipeline.
+
+    ``ingest_wait`` is the time the ingestion stage spent blocked because the
+    matchers could not keep up, and ``match_wait`` is the time the matching
+    stage spent blocked because notifications could not keep up.
+
+    The ``lag`` histogram records how old comments are when they are read
+    from the stream, and the ``stages`` histograms record the time spent
+    waiting on the stream, matching a comment and notifying an alert. Each
+    histogram, and ``keywords``, which counts the matches of each keyword, is
+    only updated from a single thread.
+
+    """
+
+    def __init__(self, limits=None):
+        """Initialize a PipelineStats instance with zeroed counters.
+
+        :param limits: When provided, a callable returning the ratelimit
+            dictionary of the Reddit instance (``reddit.auth.limits``).
+
+        """
+        self.duplicates = 0
+        self.ingested = 0
+        self.ingest_wait = 0.0
+        self.keywords = Counter()
+        self.lag = Histogram()
+        self.limits = limits
+        self.matched = 0
+        self.match_wait = 0.0
+        self.notified = 0
+        self.stages = OrderedDict((x, Histogram())
+                                  for x in ('stream', 'match', 'notify'))
+        self.started = time.time()
+
+    def line(self, pipeline):
+        """Return a single line summary of the pipeline's state."""
+        elapsed = max(time.time() - self.started, 1e-9)
+        return ('ingested={} ({:.1f}/s) duplicates={} matched={} notified={} '
+                'matching_queue={} in_flight={} notify_queue={} '
+                'ingest_wait={:.1f}s match_wait={:.1f}s lag_p50<={}s '
+                'match_p99<={}s ratelimit_remaining={} dropped: {}'.format(
+                    self.ingested, self.ingested / elapsed, self.duplicates,
+                    self.matched, self.notified, pipeline.comments.qsize(),
+                    pipeline.in_flight(), pipeline.alerts.qsize(),
+                    self.ingest_wait, self.match_wait, self.lag.quantile(0.5),
+                    self.stages['match'].quantile(0.99),
+                    self._limits().get('remaining'), ' '.join(
+                        '{}={}'.format(*x) for x
+                        in pipeline.prefilter.dropped.items())))
+
+    def _limits(self):
+        if self.limits is None:
+            return {}
+        return self.limits() or {}
+
+    def prometheus(self, pipeline):
+        """Return the pipeline's metrics in the Prometheus text format."""
+        limits = self._limits()
+        now = time.time()
+        parts = [
+            metric('reddit_alert_comments_total', 'counter',
+                   'Comments by pipeline stage.',
+                   [({'stage': 'ingested'}, self.ingested),
+                    ({'stage': 'duplicate'}, self.duplicates),
+                    ({'stage': 'matched'}, self.matched),
+                    ({'stage': 'notified'}, self.notified)]),
+            metric('reddit_alert_dropped_total', 'counter',
+                   'Comments dropped by each prefilter check.',
+                   [({'check': check}, count) for check, count
+                    in pipeline.prefilter.dropped.items()]),
+            metric('reddit_alert_blocked_seconds_total', 'counter',
+                   'Time a stage was blocked by the following stage.',
+                   [({'stage': 'ingest'}, self.ingest_wait),
+                    ({'stage': 'match'}, self.match_wait)]),
+            metric('reddit_alert_lag_seconds', 'histogram',
+                   'Age of comments when read from the stream.',
+                   [({}, self.lag)]),
+            metric('reddit_alert_stage_seconds', 'histogram',
+                   'Time spent per comment in each stage.',
+                   [({'stage': stage}, histogram) for stage, histogram
+                    in self.stages.items()]),
+            metric('reddit_alert_keyword_matches_total', 'counter',
+                   'Matching comments per keyword.',
+                   [({'keyword': keyword}, count) for keyword, count
+                    in sorted(self.keywords.items())]),
+            metric('reddit_alert_queue_depth', 'gauge',
+                   'Comments waiting between stages.',
+                   [({'queue': 'matching'}, pipeline.comments.qsize()),
+                    ({'queue': 'in_flight'}, pipeline.in_flight()),
+                    ({'queue': 'notify'}, pipeline.alerts.qsize())])]
+        if limits.get('remaining') is not None:
+            parts.append(metric(
+                'reddit_alert_ratelimit', 'gauge',
+                'Reddit API ratelimit state.',
+                [({'kind': 'remaining'}, limits['remaining']),
+                 ({'kind': 'used'}, limits['used']),
+                 ({'kind': 'reset_seconds'},
+                  max(0, limits['reset_timestamp'] - now))]))
+        return ''.join(parts)
+
+
+class AlertPipeline(object):
+    """Run reddit_alert as a pipeline of ingestion, matching and notification.
+
+    Ingestion and notification each run in their own thread, and matching
+    runs either in the calling thread or in a pool of processes. The stages
+    are connected by bounded queues so that a slow stage stalls the stages
+    before it rather than accumulating an unbounded backlog.
+
+    """
+
+    def __init__(self, keywords, notify, prefilter=None, workers=0,
+                 queue_size=1000, stats_interval=0, matcher=RegexMatcher,
+                 checkpoint=None, stats=None, metrics_file=None,
+                 metrics_interval=15):
+        """Initialize an AlertPipeline.
+
+        :param keywords: The lowercase keywords to alert on.
+        :param notify: A callable invoked with (comment, list of matched
+            keywords) for every matching comment from the notification thread.
+        :param prefilter: The Prefilter whose checks comments must pass to be
+            matched (default: keep every comment).
+        :param workers: The number of matcher processes. When 0, matching is
+            performed in the thread calling ``run``.
+        :param queue_size: The capacity of each queue between the stages.
+        :param stats_interval: When positive, the number of seconds between
+            the pipeline statistics written to stderr.
+        :param matcher: The matcher class from ``prawtools.matching`` used to
+            find keywords (default: RegexMatcher).
+        :param checkpoint: When provided, an AlertCheckpoint used to skip
+            comments that were already processed, and updated as comments are
+            processed. A matching comment is only processed once ``notify``
+            returned successfully.
+        :param stats: The PipelineStats to update (default: a new one).
+        :param metrics_file: When provided, the path to which the Prometheus
+            metrics are written every ``metrics_interval`` seconds.
+        :param metrics_interval: The number of seconds between writes to
+            ``metrics_file``.
+
+        """
+        self.alerts = queue.Queue(queue_size)
+        self.checkpoint = checkpoint
+        self.comments = queue.Queue(queue_size)
+        self.keywords = keywords
+        self.matcher = matcher
+        self.metrics_file = metrics_file
+        self.metrics_interval = metrics_interval
+        self.notify = notify
+        self.prefilter = prefilter or Prefilter()
+        self.queue_size = queue_size
+        self.stats = stats or PipelineStats()
+        self.stats_interval = stats_interval
+        self.workers = workers
+        self._completed = 0
+        self._dispatched = 0
+        self._error = None
+        self._slots = threading.BoundedSemaphore(queue_size)
+
+    def _put(self, destination, item, wait_attribute):
+        """Put item into the destination queue recording any blocked time."""
+        try:
+            destination.put_nowait(item)
+        except queue.Full:
+            start = time.time()
+            destination.put(item)
+            setattr(self.stats, wait_attribute,
+                    getattr(self.stats, wait_attribute) + time.time() - start)
+
+    def _every(self, interval, function):
+        while True:
+            time.sleep(interval)
+            try:
+                function()
+            except Exception as error:
+                sys.stderr.write('Failed to report: {!r}\n'.format(error))
+
+    def _ingest(self, stream):
+        lag, waited = self.stats.lag, self.stats.stages['stream']
+        try:
+            stream = iter(stream)
+            while True:
+                start = time.time()
+                try:
+                    comment = next(stream)
+                except StopIteration:
+                    break
+                now = time.time()
+                waited.observe(now - start)
+                lag.observe(now - comment.created_utc)
+                self.stats.ingested += 1
+                info = self.prefilter.apply(comment)
+                if info is None:
+                    continue
+                if self.checkpoint and not self.checkpoint.begin(info.id):
+                    self.stats.duplicates += 1
+                    continue
+                self._put(self.comments, info, 'ingest_wait')
+        except Exception as error:
+            self._error = error
+        self.comments.put(None)
+
+    def _notify(self):
+        histogram = self.stats.stages['notify']
+        for comment, keywords in iter(self.alerts.get, None):
+            start = time.time()
+            try:
+                self.notify(comment, keywords)
+            except Exception as error:
+                sys.stderr.write('Failed to notify {}: {!r}\n'.format(
+                    comment.id, error))
+                continue
+            finally:
+                histogram.observe(time.time() - start)
+            self.stats.notified += 1
+            if self.checkpoint:
+                self.checkpoint.complete(comment.id)
+
+    def _pending(self):
+        """Yield comments to match while bounding the matchers' backlog."""
+        for comment in iter(self.comments.get, None):
+            self._slots.acquire()
+            self._dispatched += 1
+            yield comment
+
+    def _write_line(self):
+        sys.stderr.write('{}\n'.format(self.stats.line(self)))
+
+    def _write_metrics(self):
+        write_metrics(self.metrics_file, self.stats.prometheus(self))
+
+    def _start(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def in_flight(self):
+        """Return the number of comments awaiting a matcher's result."""
+        return self._dispatched - self._completed
+
+    def run(self, stream):
+        """Alert on the comments of ``stream`` until it is exhausted."""
+        self._start(self._ingest, stream)
+        notifier = self._start(self._notify)
+        if self.stats_interval > 0:
+            self._start(self._every, self.stats_interval, self._write_line)
+        if self.metrics_file:
+            self._start(self._every, self.metrics_interval,
+                        self._write_metrics)
+
+        pool = None
+        if self.workers > 0:
+            pool = multiprocessing.Pool(
+                self.workers, _init_matcher,
+                (self.matcher, self.keywords, True))
+            results = pool.imap(_match, self._pending())
+        else:
+            _init_matcher(self.matcher, self.keywords)
+            results = map(_match, self._pending())
+
+        histogram = self.stats.stages['match']
+        try:
+            for comment, keywords, seconds in results:
+                self._completed += 1
+                self._slots.release()
+                histogram.observe(seconds)
+                if keywords:
+                    self.stats.keywords.update(keywords)
+                    self.stats.matched += 1
+                    self._put(self.alerts, (comment, keywords), 'match_wait')
+                elif self.checkpoint:
+                    self.checkpoint.complete(comment.id)
+            self.alerts.put(None)
+            notifier.join()
+        finally:
+            if self.metrics_file:
+                self._write_metrics()
+            if pool:
+                pool.terminate()
+                pool.join()
+        if self._error:
+            raise self._error
 
 
 def main():
@@ -30,63 +564,199 @@ def main():
                       help=('When at least one `-s` option is provided '
                             '(multiple can be) only alert for comments in the '
                             'indicated subreddit(s).'))
+    parser.add_option('-x', '--exclude-subreddit', action='append',
+                      metavar='SUBREDDIT',
+                      help=('Ignore comments in the provided subreddit. Can '
+                            'be supplied multiple times.'))
     parser.add_option('-I', '--ignore-user', action='append', metavar='USER',
                       help=('Ignore comments from the provided user. Can be '
                             'supplied multiple times.'))
+    parser.add_option('', '--ignore-users-file', metavar='FILE',
+                      help=('Also ignore comments from the users listed, one '
+                            'per line, in FILE.'))
+    parser.add_option('', '--min-length', type='int', default=0,
+                      metavar='N',
+                      help=('Ignore comments whose body is shorter than N '
+                            'characters [default %default]'))
     parser.add_option('-m', '--message', metavar='USER',
                       help=('When set, send a reddit message to USER with the '
                             'alert.'))
+    parser.add_option('', '--digest-size', type='int', default=1,
+                      metavar='N',
+                      help=('With --message, combine up to N alerts, grouped '
+                            'by keyword, into a single message '
+                            '[default %default]'))
+    parser.add_option('', '--digest-interval', type='float', default=300,
+                      metavar='SECONDS',
+                      help=('With --message, send a partial digest once its '
+                            'oldest alert is SECONDS old [default %default]'))
+    parser.add_option('-c', '--checkpoint', metavar='FILE',
+                      help=('Save the stream position to FILE. When FILE '
+                            'exists, first alert on the comments made since '
+                            'it was saved, and never alert twice on the same '
+                            'comment.'))
+    parser.add_option('', '--checkpoint-size', type='int', default=10000,
+                      metavar='N',
+                      help=('The minimum number of processed comment ids '
+                            'remembered by the checkpoint [default %default]'))
+    parser.add_option('-k', '--keywords-file', metavar='FILE',
+                      help=('Also alert on the keywords listed, one per line, '
+                            'in FILE.'))
+    parser.add_option('-r', '--rules', metavar='FILE',
+                      help=('Alert on the rules in the JSON rules FILE '
+                            'instead of on KEYWORDs. Each rule has its own '
+                            'keywords, subreddits, ignored users and message '
+                            'recipient, and all rules share a single comment '
+                            'stream.'))
+    parser.add_option('', '--matcher', choices=sorted(MATCHERS),
+                      help=('The keyword matching engine: `regex` treats '
+                            'keywords as regular expressions, `automaton` '
+                            'matches them literally and scales to thousands '
+                            'of keywords [default: regex, or automaton with '
+                            '--rules, which requires it]'))
+    parser.add_option('-w', '--workers', type='int', default=0,
+                      help=('The number of processes used to match comments. '
+                            'When 0, comments are matched in the main process '
+                            '[default %default]'))
+    parser.add_option('', '--queue-size', type='int', default=1000,
+                      metavar='N',
+                      help=('The maximum number of comments waiting to be '
+                            'matched, and of alerts waiting to be sent '
+                            '[default %default]'))
+    parser.add_option('', '--stats-interval', type='float', default=0,
+                      metavar='SECONDS',
+                      help=('When set, write throughput and backpressure '
+                            'statistics to stderr every SECONDS.'))
+    parser.add_option('', '--metrics-file', metavar='FILE',
+                      help=('Write Prometheus metrics to FILE every '
+                            '--metrics-interval seconds.'))
+    parser.add_option('', '--metrics-interval', type='float', default=15,
+                      metavar='SECONDS',
+                      help=('The number of seconds between writes to '
+                            '--metrics-file [default %default]'))
+    parser.add_option('', '--metrics-port', type='int', metavar='PORT',
+                      help=('Serve Prometheus metrics over HTTP on PORT.'))
     options, args = parser.parse_args()
+    if options.keywords_file:
+        args.extend(load_keywords(options.keywords_file))
+    rules = None
+    if options.rules:
+        if args or options.subreddit or options.message:
+            parser.error('KEYWORD, --keywords-file, --subreddit and --message '
+                         'cannot be combined with --rules.')
+        if options.matcher == 'regex':
+            parser.error('--rules matches keywords literally and cannot be '
+                         'combined with --matcher regex.')
+        try:
+            rules = RuleSet(load_rules(options.rules))
+        except (IOError, ValueError) as error:
+            parser.error('Invalid rules file: {}'.format(error))
+        args = rules.keywords
     if not args:
         parser.error('At least one KEYWORD must be provided.')
+    if options.workers < 0 or options.queue_size < 1:
+        parser.error('--workers must be at least 0 and --queue-size at '
+                     'least 1.')
+    if options.digest_size < 1 or options.digest_interval <= 0:
+        parser.error('--digest-size and --digest-interval must be positive.')
+    if options.checkpoint_size < 1:
+        parser.error('--checkpoint-size must be positive.')
+    if options.metrics_interval <= 0:
+        parser.error('--metrics-interval must be positive.')
 
     session = praw.Reddit(options.site, check_for_updates=False,
                           user_agent=AGENT)
 
-    if options.message:
-        msg_to = session.redditor(options.message)
-
     check_for_updates(options)
 
-    # Build regex
     args = [x.lower() for x in args]
-    reg_prefix = r'(?:^|[^a-z])'  # Any character (or start) can precede
-    reg_suffix = r'(?:$|[^a-z])'  # Any character (or end) can follow
-    regex = re.compile(r'{}({}){}'.format(reg_prefix, '|'.join(args),
-                                          reg_suffix), re.IGNORECASE)
-
-    # Determine subreddit or multireddit
-    if options.subreddit:
-        subreddit = '+'.join(sorted(options.subreddit))
+
+    # Determine subreddit or multireddit. Comments from very many subreddits
+    # are instead filtered from the stream of all comments.
+    if rules:
+        subreddits = rules.subreddits
+    elif options.subreddit:
+        subreddits = sorted(set(x.lower() for x in options.subreddit))
+    else:
+        subreddits = None
+    if subreddits and len(subreddits) <= MAX_MULTIREDDIT:
+        subreddit = '+'.join(subreddits)
     else:
         subreddit = 'all'
 
-    print('Alerting on:')
-    for item in sorted(args):
+    if rules:
+        print('Alerting on {} rules with:'.format(len(rules.rules)))
+    else:
+        print('Alerting on:')
+    for item in sorted(args)[:20]:
         print(' * {}'.format(item))
+    if len(args) > 20:
+        print(' * ... and {} more'.format(len(args) - 20))
     print('using the comment stream: https://www.reddit.com/r/{}/comments'
           .format(subreddit))
 
     # Build ignore set
-    if options.ignore_user:
-        ignore_users = set(x.lower() for x in options.ignore_user)
-    else:
-        ignore_users = set()
+    ignore_users = set(x.lower() for x in options.ignore_user or ())
+    if options.ignore_users_file:
+        ignore_users.update(load_keywords(options.ignore_users_file))
+    prefilter = Prefilter(
+        subreddits=subreddits if subreddit == 'all' else None,
+        exclude_subreddits=set(x.lower() for x in
+                               options.exclude_subreddit or ()),
+        ignore_users=ignore_users, min_length=options.min_length)
+
+    def notify(comment, keywords):
+        url = quick_url(comment)
+        if rules is None:
+            print('{}: {}'.format(', '.join(keywords), url))
+            if notifier:
+                notifier.add(options.message, comment, keywords)
+            return
+        for rule, rule_keywords in rules.resolve(comment, keywords):
+            print('{}: {}: {}'.format(rule.name, ', '.join(rule_keywords),
+                                      url))
+            if rule.message:
+                notifier.add(rule.message, comment, rule_keywords)
+
+    checkpoint = None
+    if options.checkpoint:
+        checkpoint = AlertCheckpoint(options.checkpoint, subreddit,
+                                     capacity=options.checkpoint_size)
 
+    notifier = None
+    if options.message or rules and any(x.message for x in rules.rules):
+        notifier = DigestNotifier(session, size=options.digest_size,
+                                  interval=options.digest_interval,
+                                  checkpoint=checkpoint)
+
+    pipeline = AlertPipeline(args, notify, prefilter=prefilter,
+                             workers=options.workers,
+                             queue_size=options.queue_size,
+                             stats_interval=options.stats_interval,
+                             matcher=MATCHERS[options.matcher or (
+                                 'automaton' if rules else 'regex')],
+                             checkpoint=checkpoint,
+                             stats=PipelineStats(lambda: session.auth.limits),
+                             metrics_file=options.metrics_file,
+                             metrics_interval=options.metrics_interval)
+    server = None
+    if options.metrics_port:
+        server = serve_metrics(options.metrics_port,
+                               lambda: pipeline.stats.prometheus(pipeline))
     try:
-        for comment in session.subreddit(subreddit).stream.comments():
-            if comment.author and comment.author.name.lower() in ignore_users:
-                continue
-            match = regex.search(comment.body)
-            if match:
-                keyword = match.group(1).lower()
-                url = quick_url(comment)
-                print('{}: {}'.format(keyword, url))
-                if options.message:
-                    msg_to.message(
-                        'Reddit Alert: {}'.format(keyword),
-                        '{}\n\nby /u/{}\n\n---\n\n{}'.format(
-                            url, comment.author, comment.body))
+        stream = session.subreddit(subreddit).stream.comments()
+        if checkpoint:
+            missed = backfill(session.subreddit(subreddit), checkpoint)
+            print('Backfilling {} comments'.format(len(missed)))
+            stream = itertools.chain(missed, stream)
+        pipeline.run(stream)
     except KeyboardInterrupt:
         sys.stderr.write('\n')
         print('Goodbye!\n')
+    finally:
+        if server:
+            server.shutdown()
+        if notifier:
+            notifier.close()
+        if checkpoint:
+            checkpoint.save()
@@ -0,0 +1,131 @@
+"""prawtools.cache provides an on-disk cache used by subreddit_stats."""
+from collections import namedtuple
+import sqlite3
+import threading
+import time
+
+
+CachedComment = namedtuple('CachedComment', ['author', 'created_utc',
+                                             'distinguished', 'id', 'score'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    id TEXT PRIMARY KEY, author TEXT, created_utc REAL, distinguished TEXT,
+    num_comments INTEGER, permalink TEXT, score INTEGER, title TEXT,
+    url TEXT, fetched_at REAL);
+CREATE TABLE IF NOT EXISTS comment_trees (
+    submission_id TEXT PRIMARY KEY, num_comments INTEGER, fetched_at REAL);
+CREATE TABLE IF NOT EXISTS comments (
+    submission_id TEXT, position INTEGER, author TEXT, created_utc REAL,
+    distinguished TEXT, id TEXT, score INTEGER,
+    PRIMARY KEY (submission_id, position));
+"""
+
+
+class StatsCache(object):
+    """Store submissions and their comment trees in an SQLite database.
+
+    A cached item is reused while it is younger than ``ttl`` seconds. Items
+    that were fetched when their submission was already ``settled_age``
+    seconds old are considered settled and are reused regardless of their
+    age. When ``reuse_unchanged`` is True, a comment tree is also reused
+    regardless of its age while its submission's ``num_comments`` is the
+    same as when the tree was fetched.
+
+    The cache may be shared between threads.
+
+    """
+
+    def __init__(self, path, ttl, settled_age, reuse_unchanged=False):
+        """Open (creating if necessary) the cache database at ``path``."""
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.reuse_unchanged = reuse_unchanged
+        self.settled_age = settled_age
+        self.ttl = ttl
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+
+    def _is_fresh(self, created_utc, fetched_at, now):
+        if fetched_at - created_utc >= self.settled_age:
+            return True
+        return (now or time.time()) - fetched_at < self.ttl
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._db.close()
+
+    def comments(self, submission, now=None):
+        """Return the cached comments of ``submission``.
+
+        :returns: A list of CachedComment in the order they were stored, or
+            None when the comment tree is not cached or is stale.
+
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT fetched_at, num_comments FROM comment_trees '
+                'WHERE submission_id = ?', (submission.id,)).fetchone()
+            if row is None:
+                return None
+            unchanged = (self.reuse_unchanged and
+                         row[1] == submission.num_comments)
+            if not unchanged and not self._is_fresh(submission.created_utc,
+                                                    row[0], now):
+                return None
+            return [CachedComment(*x) for x in self._db.execute(
+                'SELECT author, created_utc, distinguished, id, score '
+                'FROM comments WHERE submission_id = ? ORDER BY position',
+                (submission.id,))]
+
+    def submissions(self, ids, now=None):
+        """Return the cached submissions among ``ids``.
+
+        :returns: A dictionary mapping ids to tuples (fresh, row) where fresh
+            indicates whether the submission is younger than the ttl or
+            settled, and row is a tuple of the fields author, created_utc,
+            distinguished, id, num_comments, permalink, score, title and url.
+
+        """
+        ids = list(ids)
+        found = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):  # SQLite parameter limit
+                batch = ids[start:start + 500]
+                for row in self._db.execute(
+                        'SELECT author, created_utc, distinguished, id, '
+                        'num_comments, permalink, score, title, url, '
+                        'fetched_at FROM submissions WHERE id IN ({})'.format(
+                            ', '.join('?' * len(batch))), batch):
+                    found[row[3]] = (self._is_fresh(row[1], row[9], now),
+                                     row[:9])
+        return found
+
+    def store_comments(self, submission, comments, fetched_at=None):
+        """Replace the cached comment tree of ``submission``."""
+        fetched_at = fetched_at or time.time()
+        rows = [(submission.id, position,
+                 str(comment.author) if comment.author else None,
+                 comment.created_utc, comment.distinguished, comment.id,
+                 comment.score)
+                for position, comment in enumerate(comments)]
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM comments WHERE submission_id = ?',
+                             (submission.id,))
+            self._db.executemany('INSERT INTO comments VALUES '
+                                 '(?, ?, ?, ?, ?, ?, ?)', rows)
+            self._db.execute('INSERT OR REPLACE INTO comment_trees VALUES '
+                             '(?, ?, ?)', (submission.id,
+                                           submission.num_comments,
+                                           fetched_at))
+
+    def store_submissions(self, submissions, fetched_at=None):
+        """Insert or update the cached copies of ``submissions``."""
+        fetched_at = fetched_at or time.time()
+        rows = [(x.id, x.author, x.created_utc, x.distinguished,
+                 x.num_comments, x.permalink, x.score, x.title, x.url,
+                 fetched_at) for x in submissions]
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR REPLACE INTO submissions VALUES '
+                                 '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
@@ -0,0 +1,150 @@
+"""prawtools.checkpoint persists the stream position of reddit_alert."""
+import codecs
+import json
+import os
+import sys
+import threading
+import time
+
+
+class SeenIndex(object):
+    """A bounded set of recently seen ids.
+
+    Ids are added to the current generation. Once it holds ``capacity`` ids
+    it replaces the previous generation, which is discarded, so that at least
+    the ``capacity`` most recent ids, and at most twice as many, are kept.
+
+    """
+
+    def __init__(self, capacity, current=(), previous=()):
+        """Initialize a SeenIndex holding up to 2 * ``capacity`` ids."""
+        self.capacity = capacity
+        self.current = set(current)
+        self.previous = set(previous)
+
+    def __contains__(self, item):
+        """Return whether item was recently added."""
+        return item in self.current or item in self.previous
+
+    def __len__(self):
+        """Return the number of ids held."""
+        return len(self.current | self.previous)
+
+    def add(self, item):
+        """Add item, rotating the generations when the current one is full."""
+        if item in self.current:
+            return
+        self.current.add(item)
+        if len(self.current) >= self.capacity:
+            self.previous, self.current = self.current, set()
+
+
+class AlertCheckpoint(object):
+    """Track which comments reddit_alert has processed across restarts.
+
+    The fullname of the last processed comment and the ids of recently
+    processed comments are saved to a JSON file at most every
+    ``save_interval`` seconds and on ``save``. Comments that were handed to
+    the pipeline but not yet processed are not saved as seen so that they are
+    processed again after a crash.
+
+    The checkpoint may be shared between threads.
+
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, subreddit, capacity=10000, save_interval=10):
+        """Load the checkpoint at ``path`` if it exists.
+
+        :param path: The path to the JSON file holding the checkpoint.
+        :param subreddit: The subreddit (or ``+`` separated subreddits) being
+            watched. A checkpoint saved for different subreddits is ignored.
+        :param capacity: The minimum number of processed ids remembered.
+        :param save_interval: The minimum number of seconds between saves.
+
+        """
+        self.last = None
+        self.path = path
+        self.save_interval = save_interval
+        self.seen = SeenIndex(capacity)
+        self.subreddit = subreddit.lower()
+        self._in_flight = {}  # Comment id -> number of pending completions
+        self._lock = threading.Lock()
+        self._saved_at = time.time()
+
+        state = {}
+        if os.path.isfile(path):
+            try:
+                with codecs.open(path, 'r', 'utf-8') as fp:
+                    state = json.load(fp)
+            except ValueError:
+                sys.stderr.write('Ignoring invalid checkpoint {}\n'
+                                 .format(path))
+        if state.get('version') == self.VERSION and \
+                state.get('subreddit') == self.subreddit:
+            self.last = state['last']
+            self.seen = SeenIndex(capacity, state['seen'][0],
+                                  state['seen'][1])
+
+    def begin(self, comment_id):
+        """Return whether the comment should be processed.
+
+        Comments already processed, or currently being processed, are
+        rejected. Every accepted comment must later be passed to
+        ``complete``.
+
+        """
+        with self._lock:
+            if comment_id in self._in_flight or comment_id in self.seen:
+                return False
+            self._in_flight[comment_id] = 1
+            return True
+
+    def complete(self, comment_id):
+        """Record that the comment was processed, saving if a save is due.
+
+        A comment that was retained is only recorded as processed once it
+        has been completed as many more times as it was retained.
+
+        """
+        with self._lock:
+            pending = self._in_flight.get(comment_id, 1) - 1
+            if pending > 0:
+                self._in_flight[comment_id] = pending
+                return
+            self._in_flight.pop(comment_id, None)
+            self.seen.add(comment_id)
+            self.last = 't1_{}'.format(comment_id)
+            due = time.time() - self._saved_at >= self.save_interval
+        if due:
+            self.save()
+
+    def retain(self, comment_id):
+        """Require an additional ``complete`` before the comment is processed.
+
+        Used to delay recording a comment as processed until work started on
+        its behalf, such as delivering its alert, is done.
+
+        """
+        with self._lock:
+            if comment_id in self._in_flight:
+                self._in_flight[comment_id] += 1
+
+    def save(self):
+        """Write the checkpoint to disk."""
+        with self._lock:
+            state = {'last': self.last,
+                     'seen': [sorted(self.seen.current),
+                              sorted(self.seen.previous)],
+                     'subreddit': self.subreddit,
+                     'version': self.VERSION}
+            self._saved_at = time.time()
+            # Write to a temporary file first so that a crash while writing
+            # never leaves a truncated checkpoint behind.
+            temporary = '{}.tmp'.format(self.path)
+            with codecs.open(temporary, 'w', 'utf-8') as fp:
+                json.dump(state, fp)
+            if os.name == 'nt' and os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(temporary, self.path)
@@ -0,0 +1,73 @@
+"""prawtools.dump reads and writes the subreddit_stats dump format.
+
+A dump is a line-delimited file, gzip compressed when its name ends in
+``.gz``, where every line is a JSON array whose first item is a tag:
+
+* ``["h", {...}]``: the header, always the first line.
+* ``["s", author, created_utc, distinguished, id, num_comments, permalink,
+  score, title, url]``: a submission.
+* ``["c", submission_id, [[author, created_utc, distinguished, id, score],
+  ...]]``: the comment tree of a submission.
+
+All submissions precede the comment trees.
+
+"""
+import gzip
+import json
+import threading
+
+
+VERSION = 1
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def read_dump(path):
+    """Yield the records of the dump at ``path`` as lists."""
+    with _open(path, 'rb') as fp:
+        for line in fp:
+            yield json.loads(line.decode('utf-8'))
+
+
+class DumpWriter(object):
+    """Write submissions and comment trees to a dump file.
+
+    The writer may be shared between threads.
+
+    """
+
+    def __init__(self, path, header):
+        """Create the dump at ``path`` starting with ``header``."""
+        self._fp = _open(path, 'wb')
+        self._lock = threading.Lock()
+        header = dict(header, version=VERSION)
+        self._write(['h', header])
+
+    def _write(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._fp.write(line.encode('utf-8'))
+
+    def close(self):
+        """Flush and close the dump file."""
+        with self._lock:
+            self._fp.close()
+
+    def write_comments(self, submission_id, comments):
+        """Write the comment tree of a single submission."""
+        self._write(['c', submission_id, [
+            [comment.author, comment.created_utc, comment.distinguished,
+             comment.id, comment.score] for comment in comments]])
+
+    def write_submissions(self, submissions):
+        """Write a sequence of MiniSubmissions."""
+        for submission in submissions:
+            self._write(['s', submission.author, submission.created_utc,
+                         submission.distinguished, submission.id,
+                         submission.num_comments, submission.permalink,
+                         submission.score, submission.title,
+                         submission.url])
@@ -1,5 +1,11 @@
 """prawtools.helpers provides functions useful in other prawtools modules."""
+from itertools import count, islice
 from optparse import OptionGroup, OptionParser
+import heapq
+import json
+import tempfile
+import threading
+import time
 
 from update_checker import update_check
 
@@ -9,6 +15,78 @@ from . import __version__
 AGENT = 'prawtools/{}'.format(__version__)
 
 
+class SharedRateLimiter(object):
+    """Pace the requests of a prawcore session used by several threads.
+
+    prawcore's RateLimiter is not thread safe: threads waiting for the same
+    pacing slot all send their request when it arrives, spending the
+    ratelimit budget as many times faster. SharedRateLimiter lets a single
+    thread at a time wait for a slot, and reserves it before the request is
+    sent by spending one request of the remaining budget and computing the
+    next slot the same way prawcore does once a response is received.
+
+    """
+
+    def __init__(self, rate_limiter):
+        """Wrap a prawcore RateLimiter."""
+        self.in_flight = 0
+        self.rate_limiter = rate_limiter
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        limiter = self.rate_limiter
+        if limiter.remaining is None:
+            return
+        limiter.remaining -= 1
+        now = time.time()
+        if limiter.remaining <= 0:
+            limiter.next_request_timestamp = limiter.reset_timestamp
+            return
+        limiter.next_request_timestamp = min(
+            limiter.reset_timestamp, now + max(min(
+                (limiter.reset_timestamp - now - limiter.remaining) / 2., 10),
+                0))
+
+    def call(self, request_function, set_header_callback, *args, **kwargs):
+        """Rate limit the call to request_function.
+
+        Has the same signature as prawcore's ``RateLimiter.call``.
+
+        """
+        with self._lock:
+            self.rate_limiter.delay()
+            self._reserve()
+            self.in_flight += 1
+            kwargs['headers'] = set_header_callback()
+        try:
+            response = request_function(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.in_flight -= 1
+            raise
+        with self._lock:
+            self.in_flight -= 1
+            self.rate_limiter.update(response.headers)
+            if self.rate_limiter.remaining is not None:
+                # The response does not account for the requests in flight
+                self.rate_limiter.remaining -= self.in_flight
+        return response
+
+
+def share_rate_limit(reddit):
+    """Make the sessions of ``reddit`` safe to pace from several threads.
+
+    Must be called before the threads are started. Calling it again has no
+    effect.
+
+    """
+    for name in ('_authorized_core', '_read_only_core', '_core'):
+        session = getattr(reddit, name, None)
+        if session is not None and not isinstance(session._rate_limiter,
+                                                  SharedRateLimiter):
+            session._rate_limiter = SharedRateLimiter(session._rate_limiter)
+
+
 def arg_parser(*args, **kwargs):
     """Return a parser with common options used in the prawtools commands."""
     msg = {
@@ -33,3 +111,39 @@ def check_for_updates(options):
     """Check for package updates."""
     if not options.disable_update_check:  # Check for updates
         update_check('prawtools', __version__)
+
+
+def external_sort(items, key, buffer_size=100000):
+    """Yield ``items`` sorted by ``key`` holding at most buffer_size in memory.
+
+    Items beyond the first ``buffer_size`` are sorted in runs of
+    ``buffer_size`` that are spilled to temporary files and merged. Spilled
+    items and their keys must be JSON serializable. The sort is stable.
+
+    """
+    items = iter(items)
+    sequence = count()
+    runs = []
+    try:
+        while True:
+            run = sorted((key(item), next(sequence), item)
+                         for item in islice(items, buffer_size))
+            if not runs and len(run) < buffer_size:
+                for entry in run:  # Everything fit in memory
+                    yield entry[2]
+                return
+            if not run:
+                break
+            fp = tempfile.TemporaryFile('w+')
+            runs.append(fp)
+            for entry in run:
+                fp.write(json.dumps(entry))
+                fp.write('\n')
+            fp.seek(0)
+            del run
+        for entry in heapq.merge(*[(tuple(json.loads(line)) for line in fp)
+                                   for fp in runs]):
+            yield entry[2]
+    finally:
+        for fp in runs:
+            fp.close()
@@ -0,0 +1,31 @@
+"""prawtools.listing provides time ranged submission listings.
+
+A listing backend provides ``fetch(start, end)``, which returns the
+submissions created between the ``start`` and ``end`` timestamps, both
+inclusive, and ``limit``, the most submissions a single ``fetch`` can
+return. SubredditStats splits a period into time slices fetched concurrently
+through such a backend, and splits any slice that reaches ``limit`` further.
+
+"""
+
+
+class SearchListing(object):
+    """List the submissions of a subreddit through timestamp searches.
+
+    This relies on reddit's cloudsearch ``timestamp:START..END`` syntax,
+    which reddit may no longer honor. ``fetch_sliced_submissions`` fails when
+    results fall outside of a slice, and warns when every slice is empty.
+
+    """
+
+    limit = 1000  # Reddit never lists more than about 1000 items
+
+    def __init__(self, subreddit):
+        """Initialize a SearchListing for a praw Subreddit."""
+        self.subreddit = subreddit
+
+    def fetch(self, start, end):
+        """Return the submissions created between start and end."""
+        query = 'timestamp:{}..{}'.format(int(start), int(end))
+        return list(self.subreddit.search(query, sort='new',
+                                          syntax='cloudsearch', limit=None))
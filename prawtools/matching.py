@@ -0,0 +1,112 @@
+"""prawtools.matching provides the keyword matchers used by reddit_alert.
+
+A keyword matches when it is neither preceded nor followed by a letter, and
+case is ignored. Every matcher provides ``find_all(text)`` which returns the
+distinct matched keywords in the order they were first found.
+
+"""
+import re
+
+
+LETTERS = frozenset('abcdefghijklmnopqrstuvwxyz')
+
+
+def load_keywords(path):
+    """Return the lowercase keywords listed one per line in a file.
+
+    Blank lines, and lines starting with ``#``, are ignored.
+
+    """
+    with open(path) as fp:
+        return [line.strip().lower() for line in fp
+                if line.strip() and not line.startswith('#')]
+
+
+class RegexMatcher(object):
+    """Match keywords with a single alternation regular expression.
+
+    Keywords are interpreted as regular expressions. Matches do not overlap,
+    and when several keywords match at the same position only the first one
+    (in the order provided) is reported.
+
+    """
+
+    def __init__(self, keywords):
+        """Initialize a RegexMatcher for the (lowercase) keywords."""
+        self.regex = re.compile(r'(?<![a-z])({})(?![a-z])'.format(
+            '|'.join(keywords)), re.IGNORECASE)
+
+    def find_all(self, text):
+        """Return the distinct keywords found in text."""
+        found = []
+        for match in self.regex.finditer(text):
+            keyword = match.group(1).lower()
+            if keyword not in found:
+                found.append(keyword)
+        return found
+
+
+class AutomatonMatcher(object):
+    """Match keywords with an Aho-Corasick automaton.
+
+    Keywords are matched literally, and all matches, including overlapping
+    ones, are reported. The time to scan a text is linear in its length
+    regardless of the number of keywords.
+
+    """
+
+    def __init__(self, keywords):
+        """Initialize an AutomatonMatcher for the keywords."""
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        for keyword in set(x.lower() for x in keywords):
+            node = 0
+            for char in keyword:
+                if char not in self._goto[node]:
+                    self._goto[node][char] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                node = self._goto[node][char]
+            self._output[node] = ((keyword, len(keyword)),)
+
+        # Compute the failure links breadth first so that the output of each
+        # node includes the keywords ending at its longest proper suffix.
+        pending = list(self._goto[0].values())
+        while pending:
+            current, pending = pending, []
+            for node in current:
+                for char, child in self._goto[node].items():
+                    fail = self._fail[node]
+                    while fail and char not in self._goto[fail]:
+                        fail = self._fail[fail]
+                    fail = self._goto[fail].get(char, 0)
+                    self._fail[child] = fail if fail != child else 0
+                    self._output[child] += self._output[self._fail[child]]
+                    pending.append(child)
+
+    def find_all(self, text):
+        """Return the distinct keywords found in text."""
+        text = text.lower()
+        goto, fail, output = self._goto, self._fail, self._output
+        size = len(text)
+        found = []
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if not output[node]:
+                continue
+            if index + 1 < size and text[index + 1] in LETTERS:
+                continue
+            for keyword, length in output[node]:
+                start = index - length
+                if (start < 0 or text[start] not in LETTERS) and \
+                        keyword not in found:
+                    found.append(keyword)
+        return found
+
+
+MATCHERS = {'automaton': AutomatonMatcher, 'regex': RegexMatcher}
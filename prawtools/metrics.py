@@ -0,0 +1,133 @@
+"""prawtools.metrics provides the metrics primitives used by reddit_alert.
+
+Metrics are exported in the Prometheus text exposition format, either to a
+file or from a small HTTP server.
+
+"""
+import bisect
+import os
+import threading
+
+from six.moves import BaseHTTPServer
+
+
+SECONDS_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5,
+                   10, 30, 60, 300, 900)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in sorted(labels.items())))
+
+
+class Histogram(object):
+    """Count observations in cumulative buckets.
+
+    Observing a value costs a binary search over the bucket bounds, and only
+    the owning thread should observe values.
+
+    """
+
+    def __init__(self, buckets=SECONDS_BUCKETS):
+        """Initialize a Histogram with the sorted bucket upper bounds."""
+        self.buckets = tuple(buckets)
+        self.count = 0
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Record a single value."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, fraction):
+        """Return the upper bound of the bucket holding the quantile.
+
+        :returns: A bucket bound, ``float('inf')`` when the quantile is beyond
+            the last bound, or None when nothing was observed.
+
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def samples(self, name, labels=None):
+        """Return the Prometheus sample lines of the histogram."""
+        labels = labels or {}
+        lines = []
+        seen = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            seen += count
+            lines.append('{}_bucket{} {}'.format(
+                name, _labels(dict(labels, le=bound)), seen))
+        lines.append('{}_sum{} {}'.format(name, _labels(labels), self.sum))
+        lines.append('{}_count{} {}'.format(name, _labels(labels),
+                                            self.count))
+        return lines
+
+
+def metric(name, kind, description, samples):
+    """Return the Prometheus text of a metric.
+
+    :param name: The name of the metric.
+    :param kind: One of ``counter``, ``gauge`` or ``histogram``.
+    :param description: The help text of the metric.
+    :param samples: For histograms, a list of (labels, Histogram) tuples,
+        and otherwise a list of (labels, value) tuples.
+
+    """
+    lines = ['# HELP {} {}'.format(name, description),
+             '# TYPE {} {}'.format(name, kind)]
+    for labels, value in samples:
+        if kind == 'histogram':
+            lines.extend(value.samples(name, labels))
+        else:
+            lines.append('{}{} {}'.format(name, _labels(labels), value))
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics(path, text):
+    """Atomically replace the file at ``path`` with text."""
+    temporary = '{}.tmp'.format(path)
+    with open(temporary, 'w') as fp:
+        fp.write(text)
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(temporary, path)
+
+
+def serve_metrics(port, render, host=''):
+    """Serve the text returned by ``render()`` over HTTP from a thread.
+
+    :returns: The HTTPServer, whose ``shutdown`` method stops it.
+
+    """
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):  # noqa: N802
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type',
+                             'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = BaseHTTPServer.HTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
@@ -4,67 +4,247 @@ This command allows you to view and change some subreddit options.
 
 """
 from __future__ import print_function
+import csv
 import json
+import os
 import re
 import sys
+import time
 from collections import Counter
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 from optparse import OptionGroup
 
 from praw import Reddit
+from praw.exceptions import APIException, PRAWException
+from prawcore.exceptions import PrawcoreException
 from six.moves import input
 
-from .helpers import AGENT, arg_parser, check_for_updates
+from .helpers import (AGENT, arg_parser, check_for_updates, external_sort,
+                      share_rate_limit)
+from .snapshot import FlairSnapshots
+
+ADD_RETRIES = 3  # Attempts made to add a user after being ratelimited
+FLAIR_BATCH = 100  # The most rows a single flaircsv request accepts
+RE_NAME_SEPARATOR = re.compile('[^A-Za-z0-9_-]+')
+RE_RATELIMIT = re.compile(r'(\d+) (second|minute)')
 
 
 class ModUtils(object):
     """Class that provides all the modutils functionality."""
 
-    def __init__(self, subreddit, site=None, verbose=None):
-        """Initialize the ModUtils class by passing in config options."""
+    def __init__(self, subreddit, site=None, verbose=None, snapshots=None,
+                 max_age=None, refresh=False):
+        """Initialize the ModUtils class by passing in config options.
+
+        :param snapshots: When provided, a FlairSnapshots instance in which
+            the fetched flair is stored and from which it is reused.
+        :param max_age: Refetch flair whose snapshot is older than max_age
+            seconds (default: reuse snapshots of any age).
+        :param refresh: When True, always refetch the flair (default: False).
+
+        """
         self.reddit = Reddit(site, check_for_updates=False, user_agent=AGENT)
+        share_rate_limit(self.reddit)
         self.sub = self.reddit.subreddit(subreddit)
         self.verbose = verbose
+        self.max_age = max_age
+        self.memoize_flair = True
+        self.refresh = refresh
+        self.snapshots = snapshots
         self._current_flair = None
+        self._live_flair = True  # Whether _current_flair was fetched
 
-    def add_users(self, category):
-        """Add users to 'banned', 'contributor', or 'moderator'."""
-        mapping = {'banned': 'ban', 'contributor': 'make_contributor',
-                   'moderator': 'make_moderator'}
+    def _add_user(self, relationship, name):
+        """Add a single user to ``relationship``, retrying when ratelimited.
+
+        :returns: A tuple of the name, its status and the error if any.
+
+        """
+        for attempt in range(ADD_RETRIES + 1):
+            try:
+                relationship.add(name)
+                return name, 'added', None
+            except APIException as error:
+                if error.error_type != 'RATELIMIT' or attempt == ADD_RETRIES:
+                    return name, 'failed', str(error)
+                match = RE_RATELIMIT.search(error.message or '')
+                delay = 60
+                if match:
+                    delay = int(match.group(1)) * (
+                        60 if match.group(2) == 'minute' else 1)
+                if self.verbose:
+                    print('Ratelimited, waiting {} seconds'.format(delay))
+                time.sleep(delay)
+            except (PRAWException, PrawcoreException) as error:
+                return name, 'failed', str(error)
+
+    def add_users(self, category, path=None, workers=1, journal=None):
+        """Add users to 'banned', 'contributor', or 'moderator'.
+
+        User names are read from the file at ``path``, or from stdin, and
+        duplicates are ignored. Users that already are in ``category`` are
+        skipped without a request. Moderators are sent an invitation.
+
+        :param path: The file listing the user names (default: stdin). Any
+            separation between names should suffice.
+        :param workers: The number of users added concurrently (default: 1).
+            The workers' requests are paced through a single
+            SharedRateLimiter so that they respect the session's ratelimit.
+        :param journal: When provided, the path of a file in which the
+            outcome for each user is appended as a JSON line. Users already
+            added or skipped according to the journal are not processed
+            again, so that an interrupted run can be resumed.
+        :returns: A Counter of the number of users per outcome.
 
-        if category not in mapping:
+        """
+        if category not in ('banned', 'contributor', 'moderator'):
             print('{!r} is not a valid option for --add'.format(category))
             return
-        func = getattr(self.sub, mapping[category])
-        print('Enter user names (any separation should suffice):')
-        data = sys.stdin.read().strip()
-        for name in re.split('[^A-Za-z0-9_]+', data):
-            func(name)
-            print('Added {!r} to {}'.format(name, category))
+        relationship = getattr(self.sub, category)
+
+        done = set()
+        if journal and os.path.exists(journal):
+            with open(journal) as fp:
+                for line in fp:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:  # Truncated by an interruption
+                        continue
+                    if entry['status'] != 'failed':
+                        done.add(entry['name'].lower())
+
+        if self.verbose:
+            print('Fetching current {} users'.format(category))
+        if category == 'moderator':
+            members = relationship()
+        else:
+            members = relationship(limit=None)
+        current = set(str(x).lower() for x in members)
+
+        counts = Counter()
+
+        def pending(fp):
+            seen = set()
+            for line in fp:
+                for name in RE_NAME_SEPARATOR.split(line):
+                    key = name.lower()
+                    if not name or key in seen:
+                        continue
+                    seen.add(key)
+                    if key in done:
+                        counts['resumed'] += 1
+                    else:
+                        yield name, key in current
+
+        def process(item):
+            name, is_member = item
+            if is_member:
+                return name, 'skipped', None
+            return self._add_user(relationship, name)
+
+        if path:
+            fp = open(path)
+        else:
+            print('Enter user names (any separation should suffice):')
+            fp = sys.stdin
+        journal_fp = open(journal, 'a') if journal else None
+        pool = None
+        if workers > 1:
+            pool = ThreadPool(workers)
+            results = pool.imap_unordered(process, pending(fp))
+        else:
+            results = (process(x) for x in pending(fp))
+
+        start = time.time()
+        try:
+            for name, status, error in results:
+                counts[status] += 1
+                if journal_fp:
+                    journal_fp.write(json.dumps({'error': error, 'name': name,
+                                                 'status': status}) + '\n')
+                    journal_fp.flush()
+                if status == 'failed':
+                    print('Failed to add {!r} to {}: {}'.format(
+                        name, category, error), file=sys.stderr)
+                elif self.verbose:
+                    print('{} {!r}'.format(status.capitalize(), name))
+                processed = counts['added'] + counts['failed']
+                if status != 'skipped' and processed % 100 == 0:
+                    print('{} processed ({:.1f} users/second)'.format(
+                        processed, processed / (time.time() - start)))
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+            if journal_fp:
+                journal_fp.close()
+            if path:
+                fp.close()
+        print('{} users: {} added, {} already present, {} failed, {} '
+              'previously processed'.format(category, counts['added'],
+                                            counts['skipped'],
+                                            counts['failed'],
+                                            counts['resumed']))
+        return counts
 
     def clear_empty(self):
         """Remove flair that is not visible or has been set to empty."""
-        for flair in self.current_flair():
-            if not flair['flair_text'] and not flair['flair_css_class']:
-                print(self.reddit.flair.update(flair['user']))
-                print('Removed flair for {0}'.format(flair['user']))
-
-    def current_flair(self):
-        """Generate the flair, by user, for the subreddit."""
-        if self._current_flair is None:
-            self._current_flair = []
-            if self.verbose:
-                print('Fetching flair list for {}'.format(self.sub))
-            for flair in self.sub.flair:
-                self._current_flair.append(flair)
+        rows = ({'user': flair['user'], 'flair_text': '',
+                 'flair_css_class': ''}
+                for flair in self.current_flair(live=True)
+                if not flair['flair_text'] and not flair['flair_css_class'])
+        return self.update_flair(rows)
+
+    def current_flair(self, live=False):
+        """Generate the flair, by user, for the subreddit.
+
+        When a snapshot store is used, the flair of a recent enough snapshot
+        is reused, in which case users are provided as names rather than
+        Redditor instances. The flair is kept in memory for subsequent calls
+        unless ``memoize_flair`` is False.
+
+        :param live: When True, never use a snapshot (default: False). Flair
+            that is written based on the current flair must be live so that
+            flair set since the snapshot was taken is not overwritten.
+
+        """
+        if self._current_flair is None or (live and not self._live_flair):
+            memo = [] if self.memoize_flair else None
+            snapshot_id = None
+            if self.snapshots and not self.refresh and not live:
+                snapshot_id = self.snapshots.latest(self.sub, self.max_age)
+            if snapshot_id is not None:
+                if self.verbose:
+                    print('Using flair snapshot {} for {}'.format(
+                        snapshot_id, self.sub))
+                flair_list = self.snapshots.flair(snapshot_id)
+            else:
+                if self.verbose:
+                    print('Fetching flair list for {}'.format(self.sub))
+                flair_list = self.sub.flair
+                if self.snapshots:
+                    flair_list = self.snapshots.record(self.sub, flair_list)
+            for flair in flair_list:
+                if memo is not None:
+                    memo.append(flair)
                 yield flair
+            self._current_flair = memo
+            self._live_flair = snapshot_id is None
         else:
             for item in self._current_flair:
                 yield item
 
     def flair_template_sync(self, editable, limit,  # pylint: disable=R0912
-                            static, sort, use_css, use_text):
+                            static, sort, use_css, use_text, dry_run=False):
         """Synchronize templates with flair that already exists on the site.
 
+        Only the differences between the existing templates and the desired
+        ones are written: missing templates are added, templates no longer
+        desired are removed and templates whose editability differs are
+        updated. Templates that are added are added in ``sort`` order after
+        the templates that are kept.
+
         :param editable: Indicates that all the options should be editable.
         :param limit: The minimum number of users that must share the flair
             before it is added as a template.
@@ -72,6 +252,9 @@ class ModUtils(object):
         :param sort: The order to sort the flair templates.
         :param use_css: Include css in the templates.
         :param use_text: Include text in the templates.
+        :param dry_run: When True, only print the changes that would be made
+            (default: False).
+        :returns: The list of changes, as returned by ``flair_template_plan``.
 
         """
         # Parameter verification
@@ -96,7 +279,7 @@ class ModUtils(object):
         if self.verbose:
             sys.stdout.write('Retrieving current flair\n')
             sys.stdout.flush()
-        for flair in self.current_flair():
+        for flair in self.current_flair(live=True):
             if self.verbose:
                 sys.stdout.write('.')
                 sys.stdout.flush()
@@ -119,13 +302,9 @@ class ModUtils(object):
         else:
             items = sorted(counter.items(), key=lambda x: x[1], reverse=True)
 
-        # Clear current templates and store flair according to the sort
-        if self.verbose:
-            print('Clearing current flair templates')
-        self.sub.flair.templates.clear()
+        desired = []
         for key, count in items:
             if not key or count < limit:
-                print('a')
                 continue
             if use_text and use_css:
                 text, css = key
@@ -133,10 +312,53 @@ class ModUtils(object):
                 text, css = key, ''
             else:
                 text, css = '', key
-            if self.verbose:
-                print('Adding template: text: {!r} css: {!r}'
-                      .format(text, css))
-            self.sub.flair.templates.add(text, css, editable)
+            desired.append((text or '', css or ''))
+
+        if self.verbose:
+            print('Retrieving current flair templates')
+        templates = self.sub.flair.templates
+        plan = flair_template_plan(templates, desired, editable)
+
+        verbs = {'add': 'Adding', 'delete': 'Removing', 'update': 'Updating'}
+        for action, template_id, text, css in plan:
+            if dry_run or self.verbose:
+                print('{} template: text: {!r} css: {!r}'.format(
+                    action.capitalize() if dry_run else verbs[action],
+                    text, css))
+            if dry_run:
+                continue
+            if action == 'add':
+                templates.add(text, css, editable)
+            elif action == 'delete':
+                templates.delete(template_id)
+            else:
+                templates.update(template_id, text, css, editable)
+        counts = Counter(change[0] for change in plan)
+        print('{}{} added, {} removed, {} updated, {} unchanged'.format(
+            'Dry run: ' if dry_run else '', counts['add'], counts['delete'],
+            counts['update'], len(desired) - counts['add'] - counts['update']))
+        return plan
+
+    def import_flair(self, path):
+        """Set the flair of the users listed in the CSV file at ``path``.
+
+        Each row of the file contains a user name optionally followed by
+        their flair text and css class, as in reddit's flair CSV format.
+
+        """
+        def rows(fp):
+            for number, row in enumerate(csv.reader(fp), 1):
+                if not row:
+                    continue
+                if len(row) > 3:
+                    raise ValueError('{}:{}: expected at most 3 columns'
+                                     .format(path, number))
+                row += [''] * (3 - len(row))
+                yield {'user': row[0].strip(), 'flair_text': row[1],
+                       'flair_css_class': row[2]}
+
+        with open(path) as fp:
+            return self.update_flair(rows(fp))
 
     def message(self, category, subject, msg_file):
         """Send message to all users in `category`."""
@@ -165,11 +387,38 @@ class ModUtils(object):
             user.send_message(subject, msg)
             print('Sent to: {}'.format(user))
 
-    def output_current_flair(self, as_json=False):
-        """Display the current flair for all users in the subreddit."""
-        flair_list = sorted(self.current_flair(), key=lambda x: x['user'].name)
+    def output_current_flair(self, as_json=False, json_lines=False,
+                             sort=False, buffer_size=100000):
+        """Display the current flair for all users in the subreddit.
+
+        The flair is written as it is fetched.
+
+        :param as_json: Output a JSON array of the flair (default: False).
+        :param json_lines: Output the flair of a user per line as JSON
+            (default: False).
+        :param sort: Sort the output by user name (default: False).
+        :param buffer_size: The number of users kept in memory when sorting.
+            Beyond that, sorted runs are spilled to temporary files.
+
+        """
+        flair_list = ({'flair_css_class': x['flair_css_class'],
+                       'flair_text': x['flair_text'], 'user': str(x['user'])}
+                      for x in self.current_flair())
+        if sort:
+            flair_list = external_sort(flair_list, key=lambda x: x['user'],
+                                       buffer_size=buffer_size)
+        if json_lines:
+            for flair in flair_list:
+                print(json.dumps(flair, sort_keys=True))
+            return
         if as_json:
-            print(json.dumps(flair_list, sort_keys=True, indent=4))
+            separator = '[\n'
+            for flair in flair_list:
+                sys.stdout.write(separator + '\n'.join(
+                    '    ' + line for line in json.dumps(
+                        flair, sort_keys=True, indent=4).splitlines()))
+                separator = ',\n'
+            print('[]' if separator == '[\n' else '\n]')
             return
 
         for flair in flair_list:
@@ -177,6 +426,30 @@ class ModUtils(object):
             print('  Text: {}\n   CSS: {}'.format(flair['flair_text'],
                                                   flair['flair_css_class']))
 
+    def output_flair_diff(self, old_id=None, new_id=None):
+        """Display the users whose flair changed between two snapshots.
+
+        :param old_id: The id of the older snapshot (default: the second
+            most recent snapshot).
+        :param new_id: The id of the newer snapshot (default: the most recent
+            snapshot).
+
+        """
+        if old_id is None or new_id is None:
+            ids = [x[0] for x in self.snapshots.snapshots(self.sub)]
+            if len(ids) < 2:
+                print('At least two snapshots of {} are needed to diff.'
+                      .format(self.sub))
+                return
+            old_id, new_id = ids[-2:]
+
+        def describe(flair):
+            if flair is None:
+                return '(no flair)'
+            return 'Text: {!r} CSS: {!r}'.format(*flair)
+        for user, old, new in self.snapshots.diff(old_id, new_id):
+            print('{}\n  {} -> {}'.format(user, describe(old), describe(new)))
+
     def output_flair_stats(self):
         """Display statistics (number of users) for each unique flair item."""
         css_counter = Counter()
@@ -197,12 +470,109 @@ class ModUtils(object):
                                    key=lambda x: (x[1], x[0]), reverse=True):
             print('{0:3} {1}'.format(count, flair))
 
+    def output_flair_snapshots(self):
+        """Display the stored flair snapshots of the subreddit."""
+        print('Flair snapshots of {}:'.format(self.sub))
+        for snapshot_id, taken_at, users in self.snapshots.snapshots(
+                self.sub):
+            print('{:>6} {} {:>9} users'.format(
+                snapshot_id, time.strftime('%Y-%m-%d %H:%M:%S',
+                                           time.gmtime(taken_at)), users))
+
     def output_list(self, category):
         """Display the list of users in `category`."""
         print('{} users:'.format(category))
         for user in getattr(self.sub, category):
             print('  {}'.format(user))
 
+    def update_flair(self, rows):
+        """Set the flair of many users with a request per FLAIR_BATCH rows.
+
+        :param rows: An iterable of dictionaries with the keys ``user``,
+            ``flair_text`` and ``flair_css_class``. Empty text and css class
+            clear the user's flair.
+        :returns: A tuple of the number of users updated and a list of
+            ``(user, errors)`` tuples for the rows reddit rejected.
+
+        """
+        rows = iter(rows)
+        failures = []
+        requests = updated = 0
+        start = time.time()
+        while True:
+            batch = list(islice(rows, FLAIR_BATCH))
+            if not batch:
+                break
+            # PRAW quotes each field without escaping it
+            response = self.sub.flair.update([dict(
+                row, **{key: (row[key] or '').replace('"', '""')
+                        for key in ('flair_text', 'flair_css_class')})
+                for row in batch])
+            requests += 1
+            for row, result in zip(batch, response):
+                if result.get('ok'):
+                    updated += 1
+                    if self.verbose:
+                        print('Updated flair for {}'.format(row['user']))
+                else:
+                    errors = (result.get('errors') or result.get('warnings')
+                              or result.get('status'))
+                    failures.append((str(row['user']), errors))
+                    print('Failed to update flair for {}: {}'.format(
+                        row['user'], errors), file=sys.stderr)
+        elapsed = time.time() - start
+        print('Updated flair for {} users ({} failed) in {} requests and '
+              '{:.1f} seconds ({:.1f} users/second)'.format(
+                  updated, len(failures), requests, elapsed,
+                  (updated + len(failures)) / elapsed if elapsed else 0))
+        return updated, failures
+
+
+def _template_fields(template):
+    """Return the id, text, css class and editability of a flair template.
+
+    Templates are described with ``flair_`` prefixed keys by older versions
+    of PRAW and without them by newer ones.
+
+    """
+    def field(name, default):
+        value = template.get(name, template.get('flair_' + name, default))
+        return default if value is None else value
+    return (template.get('id', template.get('flair_template_id')),
+            field('text', ''), field('css_class', ''),
+            bool(field('text_editable', False)))
+
+
+def flair_template_plan(templates, desired, editable):
+    """Return the changes that turn ``templates`` into ``desired``.
+
+    :param templates: The existing flair templates, as listed by PRAW.
+    :param desired: The list of ``(text, css_class)`` templates to have.
+    :param editable: Whether or not the desired templates are editable.
+    :returns: A list of ``(action, template_id, text, css_class)`` tuples
+        where action is one of ``delete``, ``update`` or ``add``. Removals
+        come first so that the template limit is never exceeded.
+
+    """
+    wanted = set(desired)
+    kept = set()
+    deletes, updates = [], []
+    for template in templates:
+        template_id, text, css, is_editable = _template_fields(template)
+        key = (text, css)
+        if key not in wanted or key in kept:  # Also remove duplicates
+            deletes.append(('delete', template_id, text, css))
+            continue
+        kept.add(key)
+        if is_editable != bool(editable):
+            updates.append(('update', template_id, text, css))
+    adds = []
+    for key in desired:
+        if key not in kept:
+            kept.add(key)
+            adds.append(('add', None) + key)
+    return deletes + updates + adds
+
 
 def main():
     """Provide the entry point in the the modutils command."""
@@ -211,18 +581,45 @@ def main():
     msg = {
         'add': ('Add users to one of the following categories: {}'
                 .format(mod_choices_dsp)),
+        'add_file': ('Read the user names for --add from FILE instead of '
+                     'STDIN.'),
         'clear': 'Remove users who have no flair set.',
         'css': 'Ignore the CSS field when synchronizing flair.',
+        'dry_run': ('Print the flair template changes --sync would make '
+                    'without making them.'),
         'edit': 'When adding flair templates, mark them as editable.',
         'file': 'The file containing contents for --message',
         'flair': 'List flair for the subreddit.',
+        'flair_import': ('Set the flair of the users listed in FILE, a CSV '
+                         'file of user,text,css rows. Users are updated {} '
+                         'at a time.').format(FLAIR_BATCH),
         'flair_stats': 'Display the number of users with each flair.',
+        'max_age': ('Reuse a flair snapshot younger than HOURS instead of '
+                    'fetching the flair list. default: %default'),
+        'refresh': 'Fetch the flair list even when a snapshot is recent.',
+        'snapshot': ('Store the flair list in FILE, an SQLite database, and '
+                     'reuse it on subsequent runs for --flair and '
+                     '--flair-stats. --clear-empty and --sync always fetch '
+                     'the flair list.'),
+        'snapshot_diff': ('Display the users whose flair changed between two '
+                          'snapshots of FILE, given as OLD,NEW ids, or '
+                          '`latest` to compare the two most recent ones.'),
+        'snapshots': 'List the flair snapshots stored in FILE.',
+        'journal': ('Record the outcome of --add for each user in FILE, and '
+                    'skip the users FILE shows were already processed.'),
         'json': 'Output the results as json. Applies to --flair',
+        'json_lines': ('Output the results as json, one user per line. '
+                       'Applies to --flair'),
+        'sort_buffer': ('The number of users --sorted holds in memory before '
+                        'spilling to temporary files. default: %default'),
+        'sorted': 'Sort the output by user name. Applies to --flair',
         'limit': ('The minimum number of users that must have the specified '
                   'flair in order to add as a template. default: %default'),
         'list': ('List the users in one of the following categories: '
                  '{}. May be specified more than once.'
                  .format(mod_choices_dsp)),
+        'workers': ('The number of users --add adds concurrently. '
+                    'default: %default'),
         'msg': ('Send message to users of one of the following categories: '
                 '{}. Message subject provided via --subject, content provided '
                 'via --file or STDIN.').format(mod_choices_dsp),
@@ -247,15 +644,43 @@ def main():
     parser.add_option('-f', '--flair', action='store_true', help=msg['flair'])
     parser.add_option('', '--flair-stats', action='store_true',
                       help=msg['flair_stats'])
+    parser.add_option('', '--flair-import', metavar='FILE',
+                      help=msg['flair_import'])
     parser.add_option('-m', '--message', choices=mod_choices, help=msg['msg'])
     parser.add_option('', '--subject', help=msg['subject'])
 
+    group = OptionGroup(parser, 'Add options')
+    group.add_option('', '--add-file', metavar='FILE', help=msg['add_file'])
+    group.add_option('', '--journal', metavar='FILE', help=msg['journal'])
+    group.add_option('-w', '--workers', type='int', default=1,
+                     help=msg['workers'])
+    parser.add_option_group(group)
+
     group = OptionGroup(parser, 'Format options')
     group.add_option('-j', '--json', action='store_true', help=msg['json'])
+    group.add_option('', '--json-lines', action='store_true',
+                     help=msg['json_lines'])
+    group.add_option('', '--sorted', action='store_true', help=msg['sorted'])
+    group.add_option('', '--sort-buffer', type='int', default=100000,
+                     metavar='USERS', help=msg['sort_buffer'])
+    parser.add_option_group(group)
+
+    group = OptionGroup(parser, 'Snapshot options')
+    group.add_option('', '--snapshot', metavar='FILE', help=msg['snapshot'])
+    group.add_option('', '--max-age', type='float', default=24,
+                     metavar='HOURS', help=msg['max_age'])
+    group.add_option('', '--refresh', action='store_true',
+                     help=msg['refresh'])
+    group.add_option('', '--snapshots', action='store_true',
+                     help=msg['snapshots'])
+    group.add_option('', '--diff', metavar='OLD,NEW',
+                     help=msg['snapshot_diff'])
     parser.add_option_group(group)
 
     group = OptionGroup(parser, 'Sync options')
     group.add_option('', '--sync', action='store_true', help=msg['sync'])
+    group.add_option('', '--dry-run', action='store_true',
+                     help=msg['dry_run'])
     group.add_option('-s', '--static', action='append', help=msg['static'])
     group.add_option('', '--editable', action='store_true', help=msg['edit'])
     group.add_option('', '--ignore-css', action='store_true',
@@ -272,27 +697,62 @@ def main():
         parser.error('Must provide subreddit name.')
     if options.message and not options.subject:
         parser.error('Must provide --subject when providing --message.')
+    if options.workers < 1:
+        parser.error('--workers must be at least 1.')
+    if options.sort_buffer < 1:
+        parser.error('--sort-buffer must be at least 1.')
+    if (options.snapshots or options.diff) and not options.snapshot:
+        parser.error('--snapshots and --diff require --snapshot FILE.')
+    diff_ids = None
+    if options.diff and options.diff != 'latest':
+        try:
+            diff_ids = [int(x) for x in options.diff.split(',')]
+        except ValueError:
+            diff_ids = []
+        if len(diff_ids) != 2:
+            parser.error('--diff must be `latest` or two snapshot ids '
+                         'separated by a comma.')
     subreddit = args[0]
 
     check_for_updates(options)
 
-    modutils = ModUtils(subreddit, options.site, options.verbose)
+    snapshots = FlairSnapshots(options.snapshot) if options.snapshot else None
+    modutils = ModUtils(subreddit, options.site, options.verbose,
+                        snapshots=snapshots, max_age=options.max_age * 3600,
+                        refresh=options.refresh)
+    # Only keep the flair list in memory when several options use it
+    modutils.memoize_flair = sum(bool(x) for x in (
+        options.clear_empty, options.flair, options.flair_stats,
+        options.sync)) > 1
 
     if options.add:
-        modutils.add_users(options.add)
+        modutils.add_users(options.add, path=options.add_file,
+                           workers=options.workers, journal=options.journal)
     if options.clear_empty:
         modutils.clear_empty()
+    if options.flair_import:
+        try:
+            modutils.import_flair(options.flair_import)
+        except (IOError, ValueError) as error:
+            parser.error(str(error))
     for category in options.list:
         modutils.output_list(category)
     if options.flair:
-        modutils.output_current_flair(as_json=options.json)
+        modutils.output_current_flair(
+            as_json=options.json, json_lines=options.json_lines,
+            sort=options.sorted, buffer_size=options.sort_buffer)
     if options.flair_stats:
         modutils.output_flair_stats()
+    if options.snapshots:
+        modutils.output_flair_snapshots()
+    if options.diff:
+        modutils.output_flair_diff(*(diff_ids or ()))
     if options.sync:
         modutils.flair_template_sync(editable=options.editable,
                                      limit=options.limit,
                                      static=options.static, sort=options.sort,
                                      use_css=not options.ignore_css,
-                                     use_text=not options.ignore_text)
+                                     use_text=not options.ignore_text,
+                                     dry_run=options.dry_run)
     if options.message:
         modutils.message(options.message, options.subject, options.file)
@@ -0,0 +1,153 @@
+"""prawtools.profiling records where subreddit_stats spends its time.
+
+A StageProfiler is passed to SubredditStats which wraps each of its stages,
+such as listing submissions or fetching comment trees, in ``stage(name)``.
+Work performed many times in worker threads, such as ``replace_more``, is
+instead recorded with ``add(name, seconds)``.
+
+"""
+from contextlib import contextmanager
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+
+class StageProfiler(object):
+    """Record the wall time, requests, bytes and memory of each stage.
+
+    Stages may be nested, in which case the outer stage's figures include
+    those of the inner one, and a stage entered several times accumulates
+    its figures. Requests and bytes are counted for the whole Reddit session,
+    including requests made by worker threads while the stage is active.
+
+    The peak memory of a stage is the highest amount of memory allocated by
+    Python while the stage was active, as traced by ``tracemalloc``. It is
+    only recorded when ``memory`` is True, which noticeably slows allocation
+    heavy code down.
+
+    """
+
+    def __init__(self, memory=True):
+        """Initialize a StageProfiler.
+
+        :param memory: When True, trace memory allocations to record the peak
+            memory of each stage (default: True). Ignored when tracemalloc is
+            not available.
+
+        """
+        self.bytes = 0
+        self.memory = memory and tracemalloc is not None
+        self.requests = 0
+        self.stages = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._order = []
+        self._stack = []
+        self._tracing = self.memory and not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start()
+
+    def _on_response(self, response, *args, **kwargs):
+        size = len(response.content)
+        with self._lock:
+            self.requests += 1
+            self.bytes += size
+
+    def _record(self, name):
+        if name not in self.stages:
+            self.stages[name] = {'bytes': 0, 'calls': 0, 'peak_bytes': None,
+                                 'requests': 0, 'seconds': 0.0}
+            self._order.append(name)
+        return self.stages[name]
+
+    def _traced_peak(self):
+        """Return the traced peak memory since the last call and reset it."""
+        peak = tracemalloc.get_traced_memory()[1]
+        if hasattr(tracemalloc, 'reset_peak'):  # Python 3.9+
+            tracemalloc.reset_peak()
+        for frame in self._stack:
+            frame['peak'] = max(frame['peak'], peak)
+        return peak
+
+    def add(self, name, seconds):
+        """Record a single call of ``name`` that took ``seconds``.
+
+        Unlike ``stage`` this method may be called from any thread.
+
+        """
+        with self._lock:
+            record = self._record(name)
+            record['calls'] += 1
+            record['seconds'] += seconds
+
+    def attach(self, reddit):
+        """Count the requests made and the bytes received by ``reddit``."""
+        http = reddit._core._requestor._http
+        if self._on_response not in http.hooks['response']:
+            http.hooks['response'].append(self._on_response)
+
+    def close(self):
+        """Stop tracing memory allocations if this profiler started it."""
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        self.memory = False
+
+    def report(self):
+        """Return a JSON serializable dictionary of the recorded stages."""
+        with self._lock:
+            stages = [dict(self.stages[name], name=name)
+                      for name in self._order]
+        return {'bytes': self.bytes, 'requests': self.requests,
+                'seconds': time.time() - self.started, 'stages': stages}
+
+    @contextmanager
+    def stage(self, name):
+        """Return a context manager recording the enclosed stage.
+
+        Must only be used from a single thread.
+
+        """
+        if self.memory:
+            self._traced_peak()
+        frame = {'peak': 0}
+        self._stack.append(frame)
+        with self._lock:
+            self._record(name)  # Order stages by when they are first entered
+            requests, received = self.requests, self.bytes
+        start = time.time()
+        try:
+            yield
+        finally:
+            seconds = time.time() - start
+            if self.memory:
+                self._traced_peak()
+            self._stack.pop()
+            with self._lock:
+                record = self._record(name)
+                record['bytes'] += self.bytes - received
+                record['calls'] += 1
+                record['requests'] += self.requests - requests
+                record['seconds'] += seconds
+                if self.memory:
+                    record['peak_bytes'] = max(record['peak_bytes'] or 0,
+                                               frame['peak'])
+
+    def summary(self):
+        """Return a plain text table of the recorded stages."""
+        lines = ['{:<16} {:>7} {:>10} {:>9} {:>11} {:>9}'.format(
+            'stage', 'calls', 'seconds', 'requests', 'KiB', 'peak MiB')]
+        for stage in self.report()['stages']:
+            peak = stage['peak_bytes']
+            lines.append('{:<16} {:>7} {:>10.3f} {:>9} {:>11.1f} {:>9}'.format(
+                stage['name'], stage['calls'], stage['seconds'],
+                stage['requests'], stage['bytes'] / 1024.,
+                '-' if peak is None else '{:.1f}'.format(peak / 1048576.)))
+        lines.append('total: {:.3f} seconds, {} requests, {:.1f} KiB '
+                     'received'.format(time.time() - self.started,
+                                       self.requests, self.bytes / 1024.))
+        return '\n'.join(lines)
@@ -0,0 +1,99 @@
+"""prawtools.rules provides the alert rules of reddit_alert's rules mode.
+
+A rules file is a JSON list of rules such as::
+
+    [{"name": "praw", "keywords": ["praw", "reddit api"],
+      "subreddits": ["redditdev"], "ignore_users": ["automoderator"],
+      "message": "bboe"}]
+
+Only ``keywords`` is required. A rule without ``subreddits`` applies to
+comments from every subreddit, and a rule without ``message`` only prints its
+alerts. Keywords are matched literally.
+
+"""
+from collections import OrderedDict, namedtuple
+import codecs
+import json
+
+from six import string_types
+
+
+Rule = namedtuple('Rule', ['name', 'keywords', 'subreddits', 'ignore_users',
+                           'message'])
+
+
+def load_rules(path):
+    """Return the list of Rules in the rules file at ``path``.
+
+    :raises ValueError: When the file is not a valid rules file.
+
+    """
+    with codecs.open(path, 'r', 'utf-8') as fp:
+        data = json.load(fp)
+    if not isinstance(data, list):
+        raise ValueError('The rules file must contain a list of rules.')
+    rules = []
+    for index, item in enumerate(data):
+        if not isinstance(item, dict) or not item.get('keywords'):
+            raise ValueError('Rule {} has no keywords.'.format(index + 1))
+        for field in ('keywords', 'subreddits', 'ignore_users'):
+            value = item.get(field, [])
+            if not isinstance(value, list) or not all(
+                    isinstance(x, string_types) for x in value):
+                raise ValueError('The {} of rule {} must be a list of strings.'
+                                 .format(field, index + 1))
+        rules.append(Rule(
+            item.get('name') or 'rule{}'.format(index + 1),
+            tuple(sorted(set(x.lower() for x in item['keywords']))),
+            frozenset(x.lower() for x in item.get('subreddits', ())),
+            frozenset(x.lower() for x in item.get('ignore_users', ())),
+            item.get('message')))
+    return rules
+
+
+class RuleSet(object):
+    """Resolve keyword matches to the rules they satisfy.
+
+    Comments are matched once against the union of all the rules' keywords.
+    The rules are indexed by keyword so that resolving a comment's matches
+    only considers the rules of its matched keywords.
+
+    """
+
+    def __init__(self, rules):
+        """Initialize a RuleSet for a list of Rules."""
+        self.rules = rules
+        self._by_keyword = {}
+        for rule in rules:
+            for keyword in rule.keywords:
+                self._by_keyword.setdefault(keyword, []).append(rule)
+
+    @property
+    def keywords(self):
+        """Return the sorted list of keywords of all the rules."""
+        return sorted(self._by_keyword)
+
+    @property
+    def subreddits(self):
+        """Return the sorted subreddits to watch, or None for all of them."""
+        if any(not rule.subreddits for rule in self.rules):
+            return None
+        return sorted(set().union(*(rule.subreddits for rule in self.rules)))
+
+    def resolve(self, comment, keywords):
+        """Return a list of (rule, keywords) for the rules comment satisfies.
+
+        :param comment: The matching CommentInfo.
+        :param keywords: The keywords found in the comment.
+
+        """
+        author = (comment.author or '').lower()
+        subreddit = comment.subreddit.lower()
+        matches = OrderedDict()
+        for keyword in keywords:
+            for rule in self._by_keyword.get(keyword, ()):
+                if rule.subreddits and subreddit not in rule.subreddits or \
+                        author in rule.ignore_users:
+                    continue
+                matches.setdefault(rule, []).append(keyword)
+        return list(matches.items())
@@ -0,0 +1,137 @@
+"""prawtools.snapshot provides on-disk snapshots of a subreddit's flair."""
+import sqlite3
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, subreddit TEXT, taken_at REAL,
+    complete INTEGER);
+CREATE TABLE IF NOT EXISTS flair (
+    snapshot_id INTEGER, user TEXT, flair_text TEXT, flair_css_class TEXT,
+    PRIMARY KEY (snapshot_id, user));
+"""
+
+
+class FlairSnapshots(object):
+    """Store snapshots of the user flair of subreddits in an SQLite database.
+
+    A snapshot is written while the flair listing is paginated and is only
+    used once the listing has been completely stored. The ``keep`` most
+    recent complete snapshots of each subreddit are retained.
+
+    """
+
+    BATCH = 1000  # Rows inserted per statement while recording
+
+    def __init__(self, path, keep=5):
+        """Open (creating if necessary) the snapshot database at ``path``."""
+        self._db = sqlite3.connect(path)
+        self.keep = keep
+        with self._db:
+            self._db.executescript(SCHEMA)
+
+    def _store(self, rows):
+        with self._db:
+            self._db.executemany('INSERT OR REPLACE INTO flair VALUES '
+                                 '(?, ?, ?, ?)', rows)
+
+    def close(self):
+        """Close the underlying database connection."""
+        self._db.close()
+
+    def diff(self, old_id, new_id):
+        """Yield the users whose flair differs between two snapshots.
+
+        :returns: A generator of ``(user, old, new)`` tuples, sorted by user,
+            where ``old`` and ``new`` are ``(flair_text, flair_css_class)``
+            tuples, or None when the user had no flair in that snapshot.
+
+        """
+        query = """
+SELECT a.user, a.flair_text, a.flair_css_class, b.flair_text,
+       b.flair_css_class, 1, b.user IS NOT NULL
+FROM flair a LEFT JOIN flair b ON b.snapshot_id = ? AND b.user = a.user
+WHERE a.snapshot_id = ? AND (b.user IS NULL
+    OR a.flair_text IS NOT b.flair_text
+    OR a.flair_css_class IS NOT b.flair_css_class)
+UNION ALL
+SELECT b.user, NULL, NULL, b.flair_text, b.flair_css_class, 0, 1
+FROM flair b LEFT JOIN flair a ON a.snapshot_id = ? AND a.user = b.user
+WHERE b.snapshot_id = ? AND a.user IS NULL
+ORDER BY 1"""
+        for row in self._db.execute(query, (new_id, old_id, old_id, new_id)):
+            yield (row[0], row[1:3] if row[5] else None,
+                   row[3:5] if row[6] else None)
+
+    def flair(self, snapshot_id):
+        """Yield the flair stored in a snapshot, sorted by user name."""
+        for user, text, css in self._db.execute(
+                'SELECT user, flair_text, flair_css_class FROM flair '
+                'WHERE snapshot_id = ? ORDER BY user', (snapshot_id,)):
+            yield {'flair_css_class': css, 'flair_text': text, 'user': user}
+
+    def latest(self, subreddit, max_age=None, now=None):
+        """Return the id of the most recent complete snapshot of subreddit.
+
+        :param max_age: When provided, ignore snapshots older than
+            ``max_age`` seconds.
+        :returns: The snapshot id, or None when there is no usable snapshot.
+
+        """
+        row = self._db.execute(
+            'SELECT id, taken_at FROM snapshots WHERE subreddit = ? AND '
+            'complete ORDER BY id DESC LIMIT 1',
+            (str(subreddit).lower(),)).fetchone()
+        if row is None or (max_age is not None and
+                           (now or time.time()) - row[1] > max_age):
+            return None
+        return row[0]
+
+    def record(self, subreddit, flair, now=None):
+        """Store ``flair``, yielding each item as it is stored.
+
+        The snapshot is only marked complete, and older snapshots pruned,
+        once ``flair`` is exhausted.
+
+        """
+        subreddit = str(subreddit).lower()
+        with self._db:
+            snapshot_id = self._db.execute(
+                'INSERT INTO snapshots (subreddit, taken_at, complete) '
+                'VALUES (?, ?, 0)', (subreddit, now or time.time())).lastrowid
+        rows = []
+        for item in flair:
+            rows.append((snapshot_id, str(item['user']), item['flair_text'],
+                         item['flair_css_class']))
+            if len(rows) >= self.BATCH:
+                self._store(rows)
+                rows = []
+            yield item
+        self._store(rows)
+        with self._db:
+            self._db.execute('UPDATE snapshots SET complete = 1 WHERE id = ?',
+                             (snapshot_id,))
+            stale = [x[0] for x in self._db.execute(
+                'SELECT id FROM snapshots WHERE subreddit = ? AND complete '
+                'ORDER BY id DESC LIMIT -1 OFFSET ?', (subreddit, self.keep))]
+            stale.extend(x[0] for x in self._db.execute(
+                'SELECT id FROM snapshots WHERE subreddit = ? AND NOT '
+                'complete AND id < ?', (subreddit, snapshot_id)))
+            for stale_id in stale:
+                self._db.execute('DELETE FROM flair WHERE snapshot_id = ?',
+                                 (stale_id,))
+                self._db.execute('DELETE FROM snapshots WHERE id = ?',
+                                 (stale_id,))
+
+    def snapshots(self, subreddit):
+        """Return the complete snapshots of ``subreddit``, oldest first.
+
+        :returns: A list of ``(id, taken_at, number_of_users)`` tuples.
+
+        """
+        return self._db.execute(
+            'SELECT s.id, s.taken_at, COUNT(f.user) FROM snapshots s '
+            'LEFT JOIN flair f ON f.snapshot_id = s.id WHERE s.subreddit = ? '
+            'AND s.complete GROUP BY s.id ORDER BY s.id',
+            (str(subreddit).lower(),)).fetchall()
@@ -1,28 +1,114 @@
 """Utility to provide submission and comment statistics in a subreddit."""
 from __future__ import print_function
-from collections import defaultdict
+from bisect import insort
+from collections import OrderedDict, defaultdict, namedtuple
+from contextlib import contextmanager
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
+from optparse import OptionGroup
 from tempfile import mkstemp
 import codecs
 import gc
+import json
 import logging
 import os
 import re
+import sys
 import time
 
 
 from praw import Reddit
-from prawcore.exceptions import RequestException
+from praw.models import Comment, Submission
+from prawcore.exceptions import RequestException, ResponseException
 from six import iteritems, text_type as tt
 
-from .helpers import AGENT, arg_parser, check_for_updates
+from .cache import CachedComment, StatsCache
+from .dump import DumpWriter, read_dump
+from .helpers import AGENT, arg_parser, check_for_updates, share_rate_limit
+from .listing import SearchListing
+from .profiling import StageProfiler
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
 
 SECONDS_IN_A_DAY = 60 * 60 * 24
 RE_WHITESPACE = re.compile(r'\s+')
+INFO_BATCH = 100  # The most fullnames /api/info accepts per request
 TOP_VALUES = {'all', 'day', 'month', 'week', 'year'}
 
 logger = logging.getLogger(__package__)
 
+try:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError):  # pragma: no cover
+    PAGE_SIZE = None
+
+
+@contextmanager
+def _no_stage():
+    yield
+
+
+def _release_tree(comments):
+    """Break the reference cycles of a flattened PRAW comment tree.
+
+    PRAW comments, their submission and the comment forests between them
+    reference one another, so that without this a fetched tree is only freed
+    once the cyclic garbage collector runs. Items that are not PRAW comments
+    are left untouched.
+
+    """
+    for comment in comments:
+        if not isinstance(comment, Comment):
+            continue
+        submission = comment.__dict__.get('_submission')
+        if isinstance(submission, Submission):
+            submission.__dict__.clear()
+        comment.__dict__.clear()
+
+
+def _resident_size():
+    """Return the resident set size of the process in bytes, or None."""
+    if PAGE_SIZE is None:
+        return None
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * PAGE_SIZE
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+class AdaptiveCollector(object):
+    """Decide when a full garbage collection is worth its cost.
+
+    A full collection is due once the resident size of the process has grown
+    by ``threshold`` bytes since the previous one. When the resident size
+    cannot be measured no collection is ever due and Python's generational
+    collector is relied upon.
+
+    """
+
+    def __init__(self, threshold=64 * 1024 * 1024):
+        """Initialize an AdaptiveCollector with a growth threshold in bytes."""
+        self.collections = 0
+        self.threshold = threshold
+        self._baseline = _resident_size()
+
+    def collect(self):
+        """Run a full collection and measure the new baseline size."""
+        gc.collect()
+        self.collections += 1
+        self._baseline = _resident_size()
+
+    def due(self):
+        """Return whether the process grew enough to warrant a collection."""
+        if self._baseline is None:
+            return False
+        size = _resident_size()
+        return size is not None and size - self._baseline >= self.threshold
+
 
 class MiniComment(object):
     """Provides a memory optimized version of a Comment."""
@@ -54,6 +140,274 @@ class MiniSubmission(object):
         self.author = str(submission.author) if submission.author else None
 
 
+SubmissionRecord = namedtuple('SubmissionRecord', MiniSubmission.__slots__)
+
+
+class CommentStats(object):
+    """Aggregate comments into per-author totals and a list of top comments.
+
+    Comments are folded in as they arrive so that memory usage is bounded by
+    the number of distinct authors rather than by the number of comments.
+    Each author maps to a list of ``[count, score, first, last]`` where
+    ``first`` and ``last`` are the author's earliest and latest
+    ``created_utc``. Ties between equally ranked top comments are resolved by
+    ``created_utc`` and then in favor of the earliest added comment.
+
+    """
+
+    def __init__(self, top=10):
+        """Initialize an empty CommentStats instance.
+
+        :param top: The number of top comments to keep track of.
+
+        """
+        self.authors = {}
+        self.count = 0
+        self.first = None
+        self.last = None
+        self.score = 0
+        self.top = []
+        self.top_size = top
+
+    @classmethod
+    def from_dict(cls, data, submissions):
+        """Return a CommentStats instance built from the output of to_dict.
+
+        :param submissions: A dictionary mapping submission ids to the
+            MiniSubmissions referenced by the top comments.
+
+        """
+        stats = cls(data['top_size'])
+        for attribute in ('count', 'first', 'last', 'score'):
+            setattr(stats, attribute, data[attribute])
+        for author, totals in iteritems(data['authors']):
+            stats._merge_author(author, *totals)
+        for key, item in data['top']:
+            comment = MiniComment(CachedComment(*item[:-1]),
+                                  submissions[item[-1]])
+            stats.top.append((tuple(key), comment))
+        return stats
+
+    def add(self, comment):
+        """Fold a single MiniComment into the aggregate."""
+        created = comment.created_utc
+        if self.count == 0:
+            self.first = self.last = created
+        elif created < self.first:
+            self.first = created
+        elif created > self.last:
+            self.last = created
+        self.count += 1
+        self.score += comment.score
+        if comment.author:
+            totals = self.authors.get(comment.author)
+            if totals is None:
+                self.authors[comment.author] = [1, comment.score, created,
+                                                created]
+            else:
+                totals[0] += 1
+                totals[1] += comment.score
+                if created < totals[2]:
+                    totals[2] = created
+                elif created > totals[3]:
+                    totals[3] = created
+
+        key = (-comment.score, str(comment.author), comment.created_utc,
+               self.count, comment.id)
+        if len(self.top) < self.top_size or key < self.top[-1][0]:
+            insort(self.top, (key, comment))
+            del self.top[self.top_size:]
+
+    def merge(self, other):
+        """Fold the totals of another CommentStats into this one."""
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.first, self.last = other.first, other.last
+        else:
+            self.first = min(self.first, other.first)
+            self.last = max(self.last, other.last)
+        self.count += other.count
+        self.score += other.score
+        for author, count, score, first, last in other.author_totals():
+            self._merge_author(author, count, score, first, last)
+        for item in other.top:
+            insort(self.top, item)
+        del self.top[self.top_size:]
+
+    def _merge_author(self, author, count, score, first, last):
+        totals = self.authors.get(author)
+        if totals is None:
+            self.authors[author] = [count, score, first, last]
+        else:
+            totals[0] += count
+            totals[1] += score
+            totals[2] = min(totals[2], first)
+            totals[3] = max(totals[3], last)
+
+    def author_totals(self):
+        """Yield a tuple (author, count, score, first, last) per author."""
+        for author, totals in iteritems(self.authors):
+            yield (author,) + tuple(totals)
+
+    def extend(self, comments):
+        """Fold a sequence of MiniComments into the aggregate."""
+        for comment in comments:
+            self.add(comment)
+
+    def to_dict(self):
+        """Return a JSON serializable representation of the aggregate."""
+        return {'authors': {totals[0]: list(totals[1:])
+                            for totals in self.author_totals()},
+                'count': self.count,
+                'first': self.first, 'last': self.last, 'score': self.score,
+                'top': [[key, [comment.author, comment.created_utc, None,
+                               comment.id, comment.score,
+                               comment.submission.id]]
+                        for key, comment in self.top],
+                'top_size': self.top_size}
+
+    def top_authors(self, num):
+        """Return a list of (author, count, score) of the top ``num`` authors.
+
+        Authors are ranked by their combined score, then by their number of
+        comments, and finally by name.
+
+        """
+        return sorted(((author, count, score) for author, count, score, _, _
+                       in self.author_totals()),
+                      key=lambda x: (-x[2], -x[1], str(x[0])))[:num]
+
+
+class ColumnarCommentStats(CommentStats):
+    """A CommentStats that keeps per-author totals in NumPy arrays.
+
+    Author names are interned into a string table (``authors`` maps each name
+    to its row) and the totals are kept in one array per column. Comments are
+    folded in one comment tree at a time using vectorized operations, and the
+    top authors are selected without sorting every author.
+
+    Requires NumPy.
+
+    """
+
+    def __init__(self, top=10):
+        """Initialize an empty ColumnarCommentStats instance."""
+        if numpy is None:
+            raise RuntimeError('ColumnarCommentStats requires numpy')
+        super(ColumnarCommentStats, self).__init__(top)
+        self._names = []
+        self._counts = numpy.zeros(0, dtype=numpy.int64)
+        self._scores = numpy.zeros(0, dtype=numpy.int64)
+        self._first = numpy.zeros(0, dtype=numpy.float64)
+        self._last = numpy.zeros(0, dtype=numpy.float64)
+
+    def _author_row(self, author):
+        if not author:
+            return -1
+        row = self.authors.get(author)
+        if row is None:
+            row = self.authors[author] = len(self._names)
+            self._names.append(author)
+        return row
+
+    def _grow(self):
+        """Ensure that there is a row in each column for every author."""
+        size = len(self._counts)
+        if size >= len(self._names):
+            return
+        extra = max(len(self._names) - size, size, 1024)
+        self._counts = numpy.append(self._counts, numpy.zeros(extra, 'i8'))
+        self._scores = numpy.append(self._scores, numpy.zeros(extra, 'i8'))
+        self._first = numpy.append(self._first,
+                                   numpy.full(extra, numpy.inf))
+        self._last = numpy.append(self._last, numpy.full(extra, -numpy.inf))
+
+    def _merge_author(self, author, count, score, first, last):
+        row = self._author_row(author)
+        self._grow()
+        self._counts[row] += count
+        self._scores[row] += score
+        self._first[row] = min(self._first[row], first)
+        self._last[row] = max(self._last[row], last)
+
+    def add(self, comment):
+        """Fold a single MiniComment into the aggregate."""
+        self.extend([comment])
+
+    def author_totals(self):
+        """Yield a tuple (author, count, score, first, last) per author."""
+        for row, author in enumerate(self._names):
+            yield (author, int(self._counts[row]), int(self._scores[row]),
+                   float(self._first[row]), float(self._last[row]))
+
+    def extend(self, comments):
+        """Fold a sequence of MiniComments into the aggregate."""
+        size = len(comments)
+        if size == 0:
+            return
+        created = numpy.fromiter((x.created_utc for x in comments),
+                                 numpy.float64, size)
+        scores = numpy.fromiter((x.score for x in comments), numpy.int64,
+                                size)
+        rows = numpy.fromiter((self._author_row(x.author) for x in comments),
+                              numpy.int64, size)
+        self._grow()
+
+        if self.count == 0:
+            self.first, self.last = float(created.min()), float(created.max())
+        else:
+            self.first = min(self.first, float(created.min()))
+            self.last = max(self.last, float(created.max()))
+        offset = self.count
+        self.count += size
+        self.score += int(scores.sum())
+
+        known = rows >= 0
+        rows = rows[known]
+        numpy.add.at(self._counts, rows, 1)
+        numpy.add.at(self._scores, rows, scores[known])
+        numpy.minimum.at(self._first, rows, created[known])
+        numpy.maximum.at(self._last, rows, created[known])
+
+        # Only comments scoring at least as high as the top_size-th best
+        # comment in this batch can possibly be one of the top comments.
+        if size > self.top_size:
+            threshold = numpy.partition(scores, size - self.top_size)[
+                size - self.top_size]
+            candidates = numpy.flatnonzero(scores >= threshold)
+        else:
+            candidates = range(size)
+        for index in candidates:
+            comment = comments[index]
+            key = (-comment.score, str(comment.author), comment.created_utc,
+                   offset + index + 1, comment.id)
+            if len(self.top) < self.top_size or key < self.top[-1][0]:
+                insort(self.top, (key, comment))
+                del self.top[self.top_size:]
+
+    def top_authors(self, num):
+        """Return a list of (author, count, score) of the top ``num`` authors.
+
+        Authors are ranked by their combined score, then by their number of
+        comments, and finally by name.
+
+        """
+        size = len(self._names)
+        num = min(num, size)
+        if num <= 0:
+            return []
+        scores = self._scores[:size]
+        if num < size:
+            threshold = numpy.partition(scores, size - num)[size - num]
+            candidates = numpy.flatnonzero(scores >= threshold)
+        else:
+            candidates = range(size)
+        return sorted(((self._names[row], int(self._counts[row]),
+                        int(self._scores[row])) for row in candidates),
+                      key=lambda x: (-x[2], -x[1], x[0]))[:num]
+
+
 class SubredditStats(object):
     """Contain all the functionality of the subreddit_stats command."""
 
@@ -95,27 +449,104 @@ class SubredditStats(object):
     def _user(user):
         return '_deleted_' if user is None else tt('/u/{}').format(user)
 
-    def __init__(self, subreddit, site, distinguished, reddit=None):
-        """Initialize the SubredditStats instance with config options."""
-        self.commenters = defaultdict(list)
-        self.comments = []
+    def __init__(self, subreddit, site, distinguished, reddit=None,
+                 workers=1, cache=None, columnar=False, dump=None,
+                 profiler=None, slices=0, listing=None):
+        """Initialize the SubredditStats instance with config options.
+
+        :param cache: When provided, a StatsCache instance used to avoid
+            refetching comment trees that are still fresh.
+        :param columnar: When True, aggregate comments using the NumPy backed
+            ColumnarCommentStats (default: False).
+        :param dump: When provided, a DumpWriter to which all fetched
+            submissions and comment trees are written. See ``load_dump``.
+        :param listing: The listing backend used to fetch time slices. See
+            ``prawtools.listing`` (default: a SearchListing of the subreddit).
+        :param profiler: When provided, a StageProfiler, or any object with
+            the same ``attach``, ``stage`` and ``add`` methods, used to record
+            where time is spent.
+        :param slices: When positive, recent submissions are fetched as that
+            many time slices of the period. See ``fetch_sliced_submissions``.
+        :param workers: The number of threads used to concurrently fetch
+            comment trees, and time slices (default: 1). All workers share the
+            same ``Reddit`` session, whose requests are paced through a single
+            SharedRateLimiter so that they respect its ratelimit budget.
+
+        """
+        self.cache = cache
+        self.collector = AdaptiveCollector()
+        self.comment_stats = (ColumnarCommentStats() if columnar
+                              else CommentStats())
         self.distinguished = distinguished
+        self.dump = dump
         self.min_date = 0
         self.max_date = time.time() - SECONDS_IN_A_DAY
+        self.profiler = profiler
         self.reddit = (reddit or
                        Reddit(site, check_for_updates=False, user_agent=AGENT))
+        share_rate_limit(self.reddit)
+        if profiler:
+            profiler.attach(self.reddit)
+        self.reused = set()  # Ids of fresh submissions taken from the cache
         self.submissions = {}
         self.submitters = defaultdict(list)
         self.submit_subreddit = self.reddit.subreddit('subreddit_stats')
         self.subreddit = self.reddit.subreddit(subreddit)
+        self.listing = listing or SearchListing(self.subreddit)
+        self.slices = slices
+        self.workers = workers
+
+    def _stage(self, name):
+        """Return a context manager recording the named stage if profiling."""
+        return self.profiler.stage(name) if self.profiler else _no_stage()
+
+    def _fetch_comments(self, submission):
+        """Return a list of CachedComments for a single submission.
+
+        The list includes distinguished comments.
+
+        """
+        if submission.num_comments == 0:
+            return []
+        comments = None
+        if self.cache:
+            comments = self.cache.comments(submission)
+        if comments is None:
+            tree = self._fetch_comment_tree(submission)
+            comments = [CachedComment(
+                str(x.author) if x.author else None, x.created_utc,
+                x.distinguished, x.id, x.score) for x in tree]
+            _release_tree(tree)
+            if self.cache:
+                self.cache.store_comments(submission, comments)
+        return comments
+
+    def _fetch_comment_tree(self, submission):
+        """Return the flattened comment tree of a single submission."""
+        real_submission = self.reddit.submission(id=submission.id)
+        real_submission.comment_sort = 'top'
+
+        start = time.time()
+        for i in range(3):
+            try:
+                real_submission.comments.replace_more(limit=0)
+                break
+            except (RequestException, ResponseException) as error:
+                if i >= 2 or (isinstance(error, ResponseException) and
+                              error.response.status_code != 429):
+                    raise
+                logger.debug('Failed to fetch submission {}, retrying'
+                             .format(submission.id))
+        if self.profiler:
+            self.profiler.add('replace_more', time.time() - start)
+        return real_submission.comments.list()
 
     def basic_stats(self):
         """Return a markdown representation of simple statistics."""
-        comment_score = sum(comment.score for comment in self.comments)
-        if self.comments:
-            comment_duration = (self.comments[-1].created_utc -
-                                self.comments[0].created_utc)
-            comment_rate = self._rate(len(self.comments), comment_duration)
+        comments = self.comment_stats
+        if comments.count:
+            comment_duration = comments.last - comments.first
+            comment_rate = self._rate(comments.count, comment_duration)
         else:
             comment_rate = 0
 
@@ -124,12 +555,12 @@ class SubredditStats(object):
                                      submission_duration)
         submission_score = sum(sub.score for sub in self.submissions.values())
 
-        values = [('Total', len(self.submissions), len(self.comments)),
+        values = [('Total', len(self.submissions), comments.count),
                   ('Rate (per day)', '{:.2f}'.format(submission_rate),
                    '{:.2f}'.format(comment_rate)),
                   ('Unique Redditors', len(self.submitters),
-                   len(self.commenters)),
-                  ('Combined Score', submission_score, comment_score)]
+                   len(comments.authors)),
+                  ('Combined Score', submission_score, comments.score)]
 
         retval = 'Period: {:.2f} days\n\n'.format(submission_duration / 86400.)
         retval += '||Submissions|Comments|\n:-:|--:|--:\n'
@@ -155,15 +586,138 @@ class SubredditStats(object):
                 continue
             self.submissions[submission.id] = MiniSubmission(submission)
 
+    def _info(self, ids):
+        """Yield the submissions with ``ids`` fetched through /api/info."""
+        for start in range(0, len(ids), INFO_BATCH):
+            fullnames = ['t3_{}'.format(x)
+                         for x in ids[start:start + INFO_BATCH]]
+            for submission in self.reddit.info(fullnames):
+                yield submission
+
+    def fetch_submission_ids(self, ids):
+        """Fetch the submissions with the given ids.
+
+        Fresh submissions are taken from the cache, and the others are
+        fetched through /api/info, 100 per request. Cached submissions that
+        are stale are refreshed through ``hydrate``.
+
+        :param ids: An iterable of submission ids (without the ``t3_`` prefix).
+
+        """
+        ids = list(OrderedDict.fromkeys(ids))
+        cached = self.cache.submissions(ids) if self.cache else {}
+        stale = []
+        for fresh, row in cached.values():
+            submission = MiniSubmission(SubmissionRecord(*row))
+            self.submissions[submission.id] = submission
+            if fresh:
+                self.reused.add(submission.id)
+            else:
+                stale.append(submission)
+        self.hydrate(stale)
+        for submission in self._info([x for x in ids if x not in cached]):
+            self.submissions[submission.id] = MiniSubmission(submission)
+        logger.debug('Reused {} cached submissions, refreshed {}'
+                     .format(len(cached) - len(stale), len(stale)))
+
+    def hydrate(self, submissions):
+        """Refresh the volatile fields of MiniSubmissions through /api/info.
+
+        The ``distinguished``, ``num_comments`` and ``score`` fields are
+        updated in place, 100 submissions per request.
+
+        :returns: The number of submissions that were refreshed.
+
+        """
+        by_id = {x.id: x for x in submissions}
+        refreshed = 0
+        for submission in self._info(list(by_id)):
+            mini = by_id[submission.id]
+            mini.distinguished = submission.distinguished
+            mini.num_comments = submission.num_comments
+            mini.score = submission.score
+            refreshed += 1
+        return refreshed
+
+    def fetch_sliced_submissions(self, max_duration):
+        """Fetch recent submissions as concurrently fetched time slices.
+
+        The period is split into ``self.slices`` slices fetched through
+        ``self.listing`` by up to ``self.workers`` threads. A slice that
+        reaches the listing's limit may be incomplete, so it is split in two
+        and each half is fetched again. Submissions are deduplicated by id.
+
+        :param max_duration: When set, specifies the number of days to include
+        :raises RuntimeError: When the listing returns submissions outside of
+            a slice, as a listing that ignores time bounds would.
+
+        """
+        if max_duration:
+            self.min_date = self.max_date - SECONDS_IN_A_DAY * max_duration
+        step = (self.max_date - self.min_date) / float(self.slices)
+        pending = [(self.min_date + step * i, self.min_date + step * (i + 1))
+                   for i in range(self.slices)]
+
+        pool = ThreadPool(max(1, min(self.workers, self.slices)))
+        first = True
+        try:
+            while pending:
+                results = pool.map(lambda bounds: self.listing.fetch(*bounds),
+                                   pending)
+                if first and not any(results):
+                    logger.warning(
+                        'Every time slice was empty. Unless {} had no '
+                        'submissions in this period, its listing does not '
+                        'support time ranged searches and --slices should not '
+                        'be used.'.format(self.subreddit))
+                first = False
+                split = []
+                for (start, end), submissions in zip(pending, results):
+                    # Bounds may be truncated to whole seconds by the listing
+                    if any(not start - 1 <= x.created_utc <= end + 1
+                           for x in submissions):
+                        raise RuntimeError(
+                            'The listing returned submissions outside of the '
+                            'slice {}..{}: it does not support time ranged '
+                            'searches.'.format(int(start), int(end)))
+                    if len(submissions) >= self.listing.limit:
+                        if end - start > 1:
+                            middle = (start + end) / 2.
+                            split.extend([(start, middle), (middle, end)])
+                            continue
+                        logger.warning('Slice {} may be incomplete'
+                                       .format(start))
+                    for submission in submissions:
+                        if self.min_date < submission.created_utc <= \
+                                self.max_date:
+                            self.submissions[submission.id] = MiniSubmission(
+                                submission)
+                if split:
+                    logger.debug('Splitting {} full slices'
+                                 .format(len(split) // 2))
+                pending = split
+        finally:
+            pool.terminate()
+            pool.join()
+
     def fetch_submissions(self, submissions_callback, *args):
         """Wrap the submissions_callback function."""
         logger.debug('Fetching submissions')
 
-        submissions_callback(*args)
+        with self._stage('listing'):
+            submissions_callback(*args)
 
         logger.info('Found {} submissions'.format(len(self.submissions)))
         if not self.submissions:
             return
+        if self.cache:
+            # Reused submissions keep the time they were originally fetched
+            # so that they become stale after the cache's TTL.
+            self.cache.store_submissions(
+                x for x in self.submissions.values()
+                if x.id not in self.reused)
+        if self.dump:
+            self.dump.write_submissions(self.submissions.values())
 
         self.min_date = min(x.created_utc for x in self.submissions.values())
         self.max_date = max(x.created_utc for x in self.submissions.values())
@@ -181,41 +735,185 @@ class SubredditStats(object):
         for submission in self.subreddit.top(limit=None, time_filter=top):
             self.submissions[submission.id] = MiniSubmission(submission)
 
-    def process_commenters(self):
-        """Group comments by author."""
-        for index, submission in enumerate(self.submissions.values()):
-            if submission.num_comments == 0:
-                continue
-            real_submission = self.reddit.submission(id=submission.id)
-            real_submission.comment_sort = 'top'
+    def _iter_comment_trees(self, submissions):
+        """Yield a list of MiniComments per submission in submission order.
+
+        When more than one worker is configured the comment trees are fetched
+        concurrently, however, the results are consumed in submission order so
+        that the outcome is identical to fetching them serially.
+
+        """
+        submissions = list(submissions)
+        pool = None
+        if self.workers > 1 and len(submissions) > 1:
+            pool = ThreadPool(min(self.workers, len(submissions)))
+            results = pool.imap(self._fetch_comments, submissions)
+        else:
+            results = (self._fetch_comments(x) for x in submissions)
+
+        try:
+            for index, (submission, comments) in enumerate(
+                    zip(submissions, results)):
+                if self.dump and comments:
+                    self.dump.write_comments(submission.id, comments)
+                comments = [MiniComment(comment, submission)
+                            for comment in comments if self.distinguished
+                            or comment.distinguished is None]
+                if not comments:
+                    continue
+                yield comments
+
+                if index % 50 == 49:
+                    logger.debug('Completed: {:4d}/{} submissions'
+                                 .format(index + 1, len(submissions)))
+
+                # Comment trees are released as soon as they are condensed so
+                # only collect when memory has nonetheless grown.
+                comments = None
+                if self.collector.due():
+                    with self._stage('gc'):
+                        self.collector.collect()
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+
+    def fetch_incremental(self, days, state_path):
+        """Fetch the most recent closed days reusing previously fetched days.
+
+        Days are aligned to UTC midnight. The per-day submissions and comment
+        aggregates are persisted to ``state_path`` so that subsequent runs only
+        need to fetch the days that are not already part of the state. Days
+        that have slid out of the window are evicted from the state.
+
+        :param days: The number of days to include.
+        :param state_path: The path to the JSON file holding the state.
+
+        """
+        end = int(self.max_date // SECONDS_IN_A_DAY) * SECONDS_IN_A_DAY
+        window = [end - SECONDS_IN_A_DAY * i for i in range(days, 0, -1)]
+        identity = {'distinguished': bool(self.distinguished),
+                    'subreddit': str(self.subreddit).lower()}
+
+        state = {}
+        if os.path.isfile(state_path):
+            try:
+                with codecs.open(state_path, 'r', 'utf-8') as fp:
+                    state = json.load(fp)
+            except ValueError:
+                logger.warning('Ignoring invalid state file {}'
+                               .format(state_path))
+        if state.get('identity') != identity:
+            state = {}
+        buckets = {int(day): bucket for day, bucket
+                   in iteritems(state.get('days', {})) if int(day) in window}
+
+        missing = [day for day in window if day not in buckets]
+        logger.info('Reusing {} days, fetching {} days'
+                    .format(len(buckets), len(missing)))
+        if missing:
+            buckets.update(self._fetch_days(missing))
+
+        # Write to a temporary file first so that a crash while writing
+        # never leaves a truncated state file behind.
+        temporary = '{}.tmp'.format(state_path)
+        with codecs.open(temporary, 'w', 'utf-8') as fp:
+            json.dump({'days': {str(day): bucket
+                                for day, bucket in iteritems(buckets)},
+                       'identity': identity}, fp)
+        if os.name == 'nt' and os.path.exists(state_path):
+            os.remove(state_path)
+        os.rename(temporary, state_path)
+
+        for day in window:
+            for item in buckets[day]['submissions']:
+                submission = MiniSubmission(SubmissionRecord(*item))
+                self.submissions[submission.id] = submission
+            self.comment_stats.merge(CommentStats.from_dict(
+                buckets[day]['comments'], self.submissions))
 
-            for i in range(3):
-                try:
-                    real_submission.comments.replace_more(limit=0)
+        logger.info('Found {} submissions'.format(len(self.submissions)))
+        if not self.submissions:
+            return
+        self.min_date = min(x.created_utc for x in self.submissions.values())
+        self.max_date = max(x.created_utc for x in self.submissions.values())
+        self.process_submitters()
+
+    def _fetch_days(self, days):
+        """Return a dictionary mapping each day to its state bucket."""
+        submissions = {day: [] for day in days}
+        with self._stage('listing'):
+            for submission in self.subreddit.new(limit=None):
+                if submission.created_utc < days[0]:
                     break
-                except RequestException:
-                    if i >= 2:
-                        raise
-                    logger.debug('Failed to fetch submission {}, retrying'
-                                 .format(submission.id))
-
-            self.comments.extend(MiniComment(comment, submission)
-                                 for comment in real_submission.comments.list()
-                                 if self.distinguished
-                                 or comment.distinguished is None)
-
-            if index % 50 == 49:
-                logger.debug('Completed: {:4d}/{} submissions'
-                             .format(index + 1, len(self.submissions)))
-
-            # Clean up to reduce memory usage
-            submission = None
-            gc.collect()
-
-        self.comments.sort(key=lambda x: x.created_utc)
-        for comment in self.comments:
-            if comment.author:
-                self.commenters[comment.author].append(comment)
+                day = (int(submission.created_utc // SECONDS_IN_A_DAY)
+                       * SECONDS_IN_A_DAY)
+                if day in submissions:
+                    submissions[day].append(MiniSubmission(submission))
+        if self.cache:
+            self.cache.store_submissions(
+                x for day_submissions in submissions.values()
+                for x in day_submissions)
+
+        buckets = {day: {'comments': CommentStats(), 'submissions': [
+            [getattr(x, attribute) for attribute in MiniSubmission.__slots__]
+            for x in day_submissions]}
+            for day, day_submissions in iteritems(submissions)}
+        with self._stage('comments'):
+            for comments in self._iter_comment_trees(
+                    x for day in days for x in submissions[day]):
+                day = (int(comments[0].submission.created_utc
+                           // SECONDS_IN_A_DAY) * SECONDS_IN_A_DAY)
+                with self._stage('aggregate'):
+                    buckets[day]['comments'].extend(comments)
+        for bucket in buckets.values():
+            bucket['comments'] = bucket['comments'].to_dict()
+        return buckets
+
+    def load_dump(self, path, view):
+        """Rebuild the submissions and comment aggregates from a dump file.
+
+        :param path: The path to a dump written through a DumpWriter.
+        :param view: When a number of days, only the submissions from that
+            many days prior to the end of the dumped period are included.
+
+        """
+        records = read_dump(path)
+        header = next(records)[1]
+        if header['subreddit'].lower() != str(self.subreddit).lower():
+            raise ValueError('{} is a dump of {}'.format(
+                path, header['subreddit']))
+        if view not in TOP_VALUES:
+            self.max_date = header['max_date']
+            self.min_date = self.max_date - SECONDS_IN_A_DAY * int(view)
+
+        for record in records:
+            if record[0] == 's':
+                submission = MiniSubmission(SubmissionRecord(*record[1:]))
+                if view in TOP_VALUES or (self.min_date <
+                                          submission.created_utc <=
+                                          self.max_date):
+                    self.submissions[submission.id] = submission
+            elif record[0] == 'c' and record[1] in self.submissions:
+                submission = self.submissions[record[1]]
+                self.comment_stats.extend([
+                    MiniComment(CachedComment(*x), submission)
+                    for x in record[2] if self.distinguished or x[2] is None])
+
+        logger.info('Found {} submissions'.format(len(self.submissions)))
+        if not self.submissions:
+            return
+        self.min_date = min(x.created_utc for x in self.submissions.values())
+        self.max_date = max(x.created_utc for x in self.submissions.values())
+        self.process_submitters()
+
+    def process_commenters(self):
+        """Aggregate the comments of all submissions by author."""
+        with self._stage('comments'):
+            for comments in self._iter_comment_trees(
+                    self.submissions.values()):
+                with self._stage('aggregate'):
+                    self.comment_stats.extend(comments)
 
     def process_submitters(self):
         """Group submissions by author."""
@@ -224,8 +922,29 @@ class SubredditStats(object):
                                       submission.distinguished is None):
                 self.submitters[submission.author].append(submission)
 
-    def publish_results(self, view, submitters, commenters):
-        """Submit the results to the subreddit. Has no return value (None)."""
+    def publish_results(self, view, submitters, commenters, submit=True):
+        """Submit the results to the subreddit. Has no return value (None).
+
+        :param submit: When False, only save the report locally.
+
+        """
+        with self._stage('render'):
+            title, body = self._render(view, submitters, commenters)
+
+        with self._stage('submit'):
+            if not submit:
+                self._save_report(title, body)
+                return
+
+            try:  # Attempt to make the submission
+                return self.submit_subreddit.submit(title, selftext=body)
+            except Exception:
+                logger.exception('Failed to submit to {}'
+                                 .format(self.submit_subreddit))
+                self._save_report(title, body)
+
+    def _render(self, view, submitters, commenters):
+        """Return the title and body of the report."""
         def timef(timestamp, date_only=False):
             """Return a suitable string representaation of the timestamp."""
             dtime = datetime.fromtimestamp(timestamp)
@@ -240,75 +959,147 @@ class SubredditStats(object):
         top_comments = self.top_comments()
         top_submissions = self.top_submissions()
 
-        # Decrease number of top submitters if body is too large.
-        body = None
-        while body is None or len(body) > 40000 and submitters > 0:
-            body = (basic + self.top_submitters(submitters) + top_commenters
-                    + top_submissions + top_comments + self.post_footer)
-            submitters -= 1
+        # Include as many top submitters as fit within the body size limit,
+        # but always at least one.
+        header, entries = self._top_submitters_fragments(submitters)
+        available = 40000 - len(header) - len(
+            basic + top_commenters + top_submissions + top_comments +
+            self.post_footer)
+        count = size = 0
+        for entry in entries:
+            size += len(entry)
+            if size > available:
+                break
+            count += 1
+        top_submitters = ''
+        if entries:
+            top_submitters = header + ''.join(entries[:max(count, 1)])
+        body = (basic + top_submitters + top_commenters + top_submissions +
+                top_comments + self.post_footer)
 
         title = '{} {} {}posts from {} to {}'.format(
             self.post_prefix, str(self.subreddit),
             'top ' if view in TOP_VALUES else '', timef(self.min_date, True),
             timef(self.max_date))
+        return title, body
+
+    def run(self, view, submitters, commenters, state_path=None,
+            dump_path=None, submit=True, ids=None):
+        """Run stats and return the created Submission.
+
+        :param state_path: When provided, analyze the most recent ``view``
+            closed days incrementally, persisting per-day state to the file at
+            this path. See ``fetch_incremental``.
+        :param dump_path: When provided, read the submissions and comments
+            from the dump at this path rather than from reddit. See
+            ``load_dump``.
+        :param submit: When False, only save the report locally.
+        :param ids: When provided, analyze the submissions with these ids
+            rather than listing the subreddit. See ``fetch_submission_ids``.
 
-        try:  # Attempt to make the submission
-            return self.submit_subreddit.submit(title, selftext=body)
-        except Exception:
-            logger.exception('Failed to submit to {}'
-                             .format(self.submit_subreddit))
-            self._save_report(title, body)
-
-    def run(self, view, submitters, commenters):
-        """Run stats and return the created Submission."""
+        """
         logger.info('Analyzing subreddit: {}'.format(self.subreddit))
 
-        if view in TOP_VALUES:
-            callback = self.fetch_top_submissions
-        else:
-            callback = self.fetch_recent_submissions
+        if dump_path:
+            with self._stage('load_dump'):
+                self.load_dump(dump_path, view)
+            if view not in TOP_VALUES:
+                view = int(view)
+        elif state_path:
             view = int(view)
-        self.fetch_submissions(callback, view)
+            self.fetch_incremental(view, state_path)
+        elif ids is not None:
+            if view not in TOP_VALUES:
+                view = int(view)
+            self.fetch_submissions(self.fetch_submission_ids, ids)
+        else:
+            if view in TOP_VALUES:
+                callback = self.fetch_top_submissions
+            else:
+                callback = (self.fetch_sliced_submissions if self.slices
+                            else self.fetch_recent_submissions)
+                view = int(view)
+            self.fetch_submissions(callback, view)
 
         if not self.submissions:
             logger.warning('No submissions were found.')
             return
 
-        return self.publish_results(view, submitters, commenters)
+        return self.publish_results(view, submitters, commenters,
+                                    submit=submit)
+
+    @classmethod
+    def run_many(cls, subreddits, view, submitters, commenters, reddit,
+                 distinguished=False, pool_size=1, state_dir=None, submit=True,
+                 **kwargs):
+        """Run stats for many subreddits sharing a single Reddit session.
+
+        Failures are isolated, that is, an exception raised while analyzing
+        one subreddit is logged and does not affect the others.
+
+        :param pool_size: The number of subreddits to analyze concurrently
+            (default: 1).
+        :param state_dir: When provided, analyze each subreddit incrementally
+            keeping its state in ``<state_dir>/<subreddit>.json``.
+        :param submit: When False, only save the reports locally.
+        :returns: A list of (subreddit, result) tuples in the order of
+            ``subreddits``. The result is either the return value of ``run`` or
+            the exception that was raised.
+
+        Additional keyword arguments are passed to the constructor.
+
+        """
+        def run_one(subreddit):
+            state_path = None
+            if state_dir:
+                state_path = os.path.join(state_dir, '{}.json'.format(
+                    subreddit.lower()))
+            try:
+                srs = cls(subreddit, None, distinguished, reddit=reddit,
+                          **kwargs)
+                return subreddit, srs.run(view, submitters, commenters,
+                                          state_path=state_path,
+                                          submit=submit)
+            except Exception as exception:
+                logger.exception('Failed to analyze {}'.format(subreddit))
+                return subreddit, exception
+
+        subreddits = list(subreddits)
+        share_rate_limit(reddit)
+        pool = ThreadPool(max(1, min(pool_size, len(subreddits))))
+        try:
+            return pool.map(run_one, subreddits)
+        finally:
+            pool.terminate()
+            pool.join()
 
     def top_commenters(self, num):
         """Return a markdown representation of the top commenters."""
-        num = min(num, len(self.commenters))
+        num = min(num, len(self.comment_stats.authors))
         if num <= 0:
             return ''
 
-        top_commenters = sorted(
-            iteritems(self.commenters),
-            key=lambda x: (-sum(y.score for y in x[1]),
-                           -len(x[1]), str(x[0])))[:num]
-
         retval = self.post_header.format('Top Commenters')
-        for author, comments in top_commenters:
+        for author, count, score in self.comment_stats.top_authors(num):
             retval += '1. {} ({}, {} comment{})\n'.format(
-                self._user(author),
-                self._points(sum(x.score for x in comments)),
-                len(comments), 's' if len(comments) != 1 else '')
+                self._user(author), self._points(score), count,
+                's' if count != 1 else '')
         return '{}\n'.format(retval)
 
-    def top_submitters(self, num):
-        """Return a markdown representation of the top submitters."""
+    def _top_submitters_fragments(self, num):
+        """Return the header and per-submitter entries of top_submitters."""
         num = min(num, len(self.submitters))
         if num <= 0:
-            return ''
+            return '', []
 
         top_submitters = sorted(
             iteritems(self.submitters),
             key=lambda x: (-sum(y.score for y in x[1]),
                            -len(x[1]), str(x[0])))[:num]
 
-        retval = self.post_header.format('Top Submitters\' Top Submissions')
+        entries = []
         for (author, submissions) in top_submitters:
-            retval += '1. {}, {} submission{}: {}\n'.format(
+            entry = '1. {}, {} submission{}: {}\n'.format(
                 self._points(sum(x.score for x in submissions)),
                 len(submissions),
                 's' if len(submissions) != 1 else '', self._user(author))
@@ -316,15 +1107,23 @@ class SubredditStats(object):
                     submissions, key=lambda x: (-x.score, x.title))[:10]:
                 title = self._safe_title(sub)
                 if sub.permalink in sub.url:
-                    retval += tt('  1. {}').format(title)
+                    entry += tt('  1. {}').format(title)
                 else:
-                    retval += tt('  1. [{}]({})').format(title, sub.url)
-                retval += ' ({}, [{} comment{}]({}))\n'.format(
+                    entry += tt('  1. [{}]({})').format(title, sub.url)
+                entry += ' ({}, [{} comment{}]({}))\n'.format(
                     self._points(sub.score), sub.num_comments,
                     's' if sub.num_comments != 1 else '',
                     self._permalink(sub))
-            retval += '\n'
-        return retval
+            entries.append(entry + '\n')
+        header = self.post_header.format('Top Submitters\' Top Submissions')
+        return header, entries
+
+    def top_submitters(self, num):
+        """Return a markdown representation of the top submitters."""
+        header, entries = self._top_submitters_fragments(num)
+        if not entries:
+            return ''
+        return header + ''.join(entries)
 
     def top_submissions(self):
         """Return a markdown representation of the top submissions."""
@@ -356,14 +1155,12 @@ class SubredditStats(object):
 
     def top_comments(self):
         """Return a markdown representation of the top comments."""
-        num = min(10, len(self.comments))
+        num = min(10, self.comment_stats.count)
         if num <= 0:
             return ''
 
-        top_comments = sorted(
-            self.comments, key=lambda x: (-x.score, str(x.author)))[:num]
         retval = self.post_header.format('Top Comments')
-        for comment in top_comments:
+        for _, comment in self.comment_stats.top[:num]:
             title = self._safe_title(comment.submission)
             retval += tt('1. {}: {}\'s [comment]({}) in {}\n').format(
                 self._points(comment.score), self._user(comment.author),
@@ -373,7 +1170,8 @@ class SubredditStats(object):
 
 def main():
     """Provide the entry point to the subreddit_stats command."""
-    parser = arg_parser(usage='usage: %prog [options] SUBREDDIT VIEW')
+    parser = arg_parser(usage='usage: %prog [options] SUBREDDIT VIEW\n'
+                        '       %prog [options] --batch FILE VIEW')
     parser.add_option('-c', '--commenters', type='int', default=10,
                       help='Number of top commenters to display '
                       '[default %default]')
@@ -385,6 +1183,76 @@ def main():
     parser.add_option('-s', '--submitters', type='int', default=10,
                       help='Number of top submitters to display '
                       '[default %default]')
+    parser.add_option('-w', '--workers', type='int', default=1,
+                      help=('Number of comment trees, and of --slices, to '
+                            'fetch concurrently [default %default]'))
+    parser.add_option('', '--slices', type='int', default=0, metavar='N',
+                      help=('Fetch the submissions of the last VIEW days as '
+                            'N time slices searched concurrently rather than '
+                            'by paging through the (at most 1000 item) new '
+                            'listing. Slices holding too many submissions '
+                            'are split further.'))
+    parser.add_option('', '--columnar', action='store_true',
+                      help=('Aggregate comments in NumPy arrays which is '
+                            'faster for subreddits with many commenters '
+                            '(requires numpy).'))
+    parser.add_option('', '--profile', metavar='FILE',
+                      help=('Record the time, requests, bytes received and '
+                            'peak memory of each stage of the run. A summary '
+                            'is written to stderr and the details to FILE as '
+                            'JSON.'))
+    parser.add_option('', '--ids', metavar='FILE',
+                      help=('Analyze the submissions whose ids are listed, '
+                            'one per line, in FILE rather than listing '
+                            'SUBREDDIT. VIEW is only used in the title.'))
+    parser.add_option('-i', '--incremental', metavar='STATE_FILE',
+                      help=('Analyze the last VIEW closed (UTC) days reusing '
+                            'the per-day results stored in STATE_FILE so that '
+                            'only days not yet in STATE_FILE are fetched.'))
+
+    group = OptionGroup(parser, 'Cache options')
+    group.add_option('', '--cache-dir', metavar='DIR',
+                     help=('Store fetched submissions and comment trees in '
+                           'DIR and reuse them on subsequent runs.'))
+    group.add_option('', '--cache-ttl', type='float', default=12,
+                     metavar='HOURS',
+                     help='Refetch cached items older than HOURS '
+                     '[default %default]')
+    group.add_option('', '--settled-age', type='float', default=2,
+                     metavar='DAYS',
+                     help=('Never refetch comment trees fetched when their '
+                           'submission was at least DAYS old '
+                           '[default %default]'))
+    group.add_option('', '--reuse-unchanged', action='store_true',
+                     help=('Reuse cached comment trees regardless of their '
+                           'age while the number of comments of their '
+                           'submission is unchanged. Comment scores may then '
+                           'be out of date.'))
+    parser.add_option_group(group)
+
+    group = OptionGroup(parser, 'Dump options')
+    group.add_option('', '--dump', metavar='FILE',
+                     help=('Write all fetched submissions and comments to '
+                           'FILE (gzip compressed when FILE ends in .gz).'))
+    group.add_option('', '--from-dump', metavar='FILE',
+                     help=('Read submissions and comments from FILE, as '
+                           'written by --dump, rather than from reddit.'))
+    group.add_option('-n', '--no-submit', action='store_true',
+                     help=('Save the report locally rather than submitting '
+                           'it to /r/subreddit_stats.'))
+    parser.add_option_group(group)
+
+    group = OptionGroup(parser, 'Batch options')
+    group.add_option('-b', '--batch', metavar='FILE',
+                     help=('Analyze every subreddit listed (one per line) in '
+                           'FILE using a single reddit session. With '
+                           '--incremental, STATE_FILE is a directory holding '
+                           'one state file per subreddit.'))
+    group.add_option('', '--batch-workers', type='int', default=1,
+                     metavar='N',
+                     help='Number of subreddits to analyze concurrently '
+                     '[default %default]')
+    parser.add_option_group(group)
 
     options, args = parser.parse_args()
 
@@ -396,12 +1264,110 @@ def main():
         logger.setLevel(logging.NOTSET)
     logger.addHandler(logging.StreamHandler())
 
-    if len(args) != 2:
+    if options.batch:
+        if len(args) != 1:
+            parser.error('VIEW must be provided')
+        view = args[0]
+    elif len(args) != 2:
         parser.error('SUBREDDIT and VIEW must be provided')
-    subreddit, view = args
+    else:
+        subreddit, view = args
+    if options.workers < 1 or options.batch_workers < 1:
+        parser.error('--workers and --batch-workers must be at least 1')
+    if options.slices < 0:
+        parser.error('--slices must not be negative')
+    if options.slices and (view in TOP_VALUES or options.incremental or
+                           options.ids or options.from_dump):
+        parser.error('--slices requires VIEW to be a number of days and '
+                     'cannot be combined with --incremental, --ids or '
+                     '--from-dump')
+    if options.columnar and numpy is None:
+        parser.error('--columnar requires numpy: pip install numpy')
+    if options.incremental and not view.isdigit():
+        parser.error('VIEW must be a number of days with --incremental')
+    if options.dump and (options.batch or options.from_dump or
+                         options.incremental):
+        parser.error('--dump cannot be combined with --batch, --from-dump '
+                     'or --incremental')
+    if options.from_dump and (options.batch or options.incremental):
+        parser.error('--from-dump cannot be combined with --batch or '
+                     '--incremental')
+    if options.ids and (options.batch or options.from_dump or
+                        options.incremental):
+        parser.error('--ids cannot be combined with --batch, --from-dump or '
+                     '--incremental')
+    if options.profile and options.batch:
+        parser.error('--profile cannot be combined with --batch')
     check_for_updates(options)
-    srs = SubredditStats(subreddit, options.site, options.distinguished)
-    result = srs.run(view, options.submitters, options.commenters)
+
+    cache = None
+    if options.cache_dir:
+        if not os.path.isdir(options.cache_dir):
+            os.makedirs(options.cache_dir)
+        cache = StatsCache(
+            os.path.join(options.cache_dir, 'subreddit_stats.sqlite'),
+            ttl=options.cache_ttl * 3600,
+            settled_age=options.settled_age * SECONDS_IN_A_DAY,
+            reuse_unchanged=options.reuse_unchanged)
+
+    if options.batch:
+        return run_batch(options, view, cache)
+
+    ids = None
+    if options.ids:
+        with codecs.open(options.ids, 'r', 'utf-8') as fp:
+            ids = [line.strip().split('_')[-1] for line in fp
+                   if line.strip() and not line.startswith('#')]
+
+    profiler = StageProfiler() if options.profile else None
+    srs = SubredditStats(subreddit, options.site, options.distinguished,
+                         workers=options.workers, cache=cache,
+                         columnar=options.columnar, profiler=profiler,
+                         slices=options.slices)
+    if options.dump:
+        srs.dump = DumpWriter(options.dump, {'max_date': srs.max_date,
+                                             'subreddit': subreddit})
+    try:
+        result = srs.run(view, options.submitters, options.commenters,
+                         state_path=options.incremental,
+                         dump_path=options.from_dump,
+                         submit=not options.no_submit, ids=ids)
+    finally:
+        if srs.dump:
+            srs.dump.close()
+        if profiler:
+            profiler.close()
+            sys.stderr.write('{}\n'.format(profiler.summary()))
+            with codecs.open(options.profile, 'w', 'utf-8') as fp:
+                json.dump(profiler.report(), fp, indent=2)
     if result:
         print(result.permalink)
     return 0
+
+
+def run_batch(options, view, cache):
+    """Run subreddit_stats for every subreddit in the --batch file."""
+    with codecs.open(options.batch, 'r', 'utf-8') as fp:
+        subreddits = [line.strip() for line in fp
+                      if line.strip() and not line.startswith('#')]
+    if options.incremental and not os.path.isdir(options.incremental):
+        os.makedirs(options.incremental)
+
+    reddit = Reddit(options.site, check_for_updates=False, user_agent=AGENT)
+    results = SubredditStats.run_many(
+        subreddits, view, options.submitters, options.commenters, reddit,
+        distinguished=options.distinguished,
+        pool_size=options.batch_workers, state_dir=options.incremental,
+        submit=not options.no_submit, cache=cache, columnar=options.columnar,
+        slices=options.slices, workers=options.workers)
+
+    failures = 0
+    for subreddit, result in results:
+        if isinstance(result, Exception):
+            failures += 1
+            print('{}: failed ({})'.format(subreddit, result))
+        elif result:
+            print('{}: {}'.format(subreddit, result.permalink))
+        else:
+            print('{}: no report submitted'.format(subreddit))
+    return 1 if failures else 0
@@ -34,6 +34,7 @@ setup(name=PACKAGE_NAME,
           'console_scripts': ['modutils = prawtools.mod:main',
                               'reddit_alert = prawtools.alert:main',
                               'subreddit_stats = prawtools.stats:main']},
+      extras_require={'columnar': ['numpy']},
       install_requires=['praw >=4.0.0, <7', 'six >=1, <2'],
       keywords='reddit mod moderator subreddit statistics tools',
       license='Simplified BSD License',
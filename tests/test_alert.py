@@ -0,0 +1,338 @@
+"""Test reddit_alert."""
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import mock
+from six.moves.urllib.request import urlopen
+from prawtools.alert import (AlertPipeline, CommentInfo, DigestNotifier,
+                             PipelineStats, Prefilter, backfill, quick_url)
+from prawtools.checkpoint import AlertCheckpoint, SeenIndex
+from prawtools.matching import AutomatonMatcher, RegexMatcher
+from prawtools.metrics import Histogram, serve_metrics
+from prawtools.rules import RuleSet, load_rules
+
+
+def fake_comment(id, body, author='author', subreddit='redditdev'):
+    """Return a mock that looks enough like a PRAW Comment."""
+    comment = mock.Mock(body=body, created_utc=time.time() - 5,
+                        fullname='t1_{}'.format(id), id=id, link_id='t3_sub')
+    comment.author.name = author
+    comment.subreddit.display_name = subreddit
+    return comment
+
+
+class AlertPipelineTest(unittest.TestCase):
+    def setUp(self):
+        """Setup runs before all test cases."""
+        self.stream = [fake_comment('c{}'.format(i), body, author)
+                       for i, (body, author) in enumerate([
+                           ('I like PRAW.', 'a'), ('nothing here', 'a'),
+                           ('prawtools', 'a'), ('praw by bboe', 'bot'),
+                           ('Hello bboe', 'b')] * 20)]
+
+    def run_pipeline(self, workers, matcher=RegexMatcher):
+        alerts = []
+        pipeline = AlertPipeline(
+            ['praw', 'bboe'], lambda *args: alerts.append(args),
+            prefilter=Prefilter(ignore_users={'bot'}), workers=workers,
+            queue_size=3, matcher=matcher)
+        pipeline.run(iter(self.stream))
+        self.assertEqual(100, pipeline.stats.ingested)
+        self.assertEqual(20, pipeline.prefilter.dropped['author'])
+        self.assertEqual(40, pipeline.stats.notified)
+        return [(comment.id, keywords) for comment, keywords in alerts]
+
+    def test_run(self):
+        alerts = self.run_pipeline(0)
+        self.assertEqual([('c0', ['praw']), ('c4', ['bboe'])], alerts[:2])
+        self.assertEqual(alerts, self.run_pipeline(2, AutomatonMatcher))
+
+    def test_quick_url(self):
+        comment = CommentInfo('author', '', 'c0', 't3_sub', 'redditdev')
+        self.assertEqual('http://www.reddit.com/r/redditdev/comments/sub/_/c0'
+                         '?context=3', quick_url(comment))
+
+
+class MetricsTest(unittest.TestCase):
+    def test_histogram(self):
+        histogram = Histogram((1, 5))
+        self.assertIsNone(histogram.quantile(0.5))
+        for value in (0.5, 1, 2, 3, 10):
+            histogram.observe(value)
+        self.assertEqual((1, 5, float('inf')),
+                         tuple(histogram.quantile(x) for x in (0.4, 0.8, 1)))
+        self.assertEqual(['x_bucket{le="1",stage="a"} 2',
+                          'x_bucket{le="5",stage="a"} 4',
+                          'x_bucket{le="+Inf",stage="a"} 5',
+                          'x_sum{stage="a"} 16.5', 'x_count{stage="a"} 5'],
+                         histogram.samples('x', {'stage': 'a'}))
+
+    def test_metrics(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'metrics.prom')
+        limits = {'remaining': 598.0, 'reset_timestamp': 0, 'used': 2}
+        pipeline = AlertPipeline(
+            ['praw', 'bboe'], lambda *args: None,
+            stats=PipelineStats(lambda: limits), metrics_file=path)
+        pipeline.run(iter([fake_comment('c0', 'praw bboe'),
+                           fake_comment('c1', 'praw'),
+                           fake_comment('c2', 'other')]))
+        with open(path) as fp:
+            text = fp.read()
+        server = serve_metrics(0, lambda: pipeline.stats.prometheus(pipeline),
+                               host='127.0.0.1')
+        self.addCleanup(server.shutdown)
+        self.assertEqual(text, urlopen('http://127.0.0.1:{}/metrics'.format(
+            server.server_address[1])).read().decode('utf-8'))
+        for line in ('reddit_alert_comments_total{stage="ingested"} 3',
+                     'reddit_alert_keyword_matches_total{keyword="bboe"} 1',
+                     'reddit_alert_keyword_matches_total{keyword="praw"} 2',
+                     'reddit_alert_lag_seconds_bucket{le="10"} 3',
+                     'reddit_alert_queue_depth{queue="in_flight"} 0',
+                     'reddit_alert_ratelimit{kind="remaining"} 598.0',
+                     'reddit_alert_stage_seconds_count{stage="notify"} 2'):
+            self.assertIn(line, text.splitlines())
+        self.assertIn('lag_p50<=10s', pipeline.stats.line(pipeline))
+
+
+class PrefilterTest(unittest.TestCase):
+    def test_apply(self):
+        prefilter = Prefilter(subreddits={'redditdev', 'python'},
+                              exclude_subreddits={'python'},
+                              ignore_users={'bot'}, min_length=5)
+        comments = [fake_comment('c0', 'praw is great'),
+                    fake_comment('c1', 'praw', subreddit='RedditDev'),
+                    fake_comment('c2', 'praw tools', author='Bot'),
+                    fake_comment('c3', 'python', subreddit='python'),
+                    fake_comment('c4', 'praw tools', subreddit='all')]
+        comments[0].author = None
+        self.assertEqual(
+            [CommentInfo(None, 'praw is great', 'c0', 't3_sub', 'redditdev'),
+             None, None, None, None],
+            [prefilter.apply(comment) for comment in comments])
+        self.assertEqual({'author': 1, 'length': 1, 'subreddit': 2},
+                         dict(prefilter.dropped))
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        """Setup runs before all test cases."""
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'checkpoint.json')
+        self.stream = [fake_comment('c{}'.format(i), 'praw') for i in range(6)]
+
+    def tearDown(self):
+        """Teardown runs after all test cases."""
+        shutil.rmtree(self.directory)
+
+    def run_pipeline(self, stream):
+        alerts = []
+        checkpoint = AlertCheckpoint(self.path, 'redditdev')
+        pipeline = AlertPipeline(['praw'], lambda *args: alerts.append(args),
+                                 checkpoint=checkpoint)
+        pipeline.run(iter(stream))
+        checkpoint.save()
+        return [comment.id for comment, _ in alerts], checkpoint
+
+    def test_backfill(self):
+        self.run_pipeline(self.stream[:3])
+        checkpoint = AlertCheckpoint(self.path, 'redditdev')
+        self.assertEqual('t1_c2', checkpoint.last)
+        subreddit = mock.Mock()
+        subreddit.comments.return_value = iter(self.stream[::-1])
+        self.assertEqual(['c3', 'c4', 'c5'],
+                         [x.id for x in backfill(subreddit, checkpoint)])
+
+    def test_resume(self):
+        self.assertEqual(['c0', 'c1', 'c2'],
+                         self.run_pipeline(self.stream[:3])[0])
+        # The restarted stream replays already processed comments
+        alerts, checkpoint = self.run_pipeline(self.stream[1:] +
+                                               self.stream[4:])
+        self.assertEqual(['c3', 'c4', 'c5'], alerts)
+        self.assertEqual('t1_c5', checkpoint.last)
+
+    def test_undelivered(self):
+        checkpoint = AlertCheckpoint(self.path, 'redditdev')
+        digests = DigestNotifier(mock.Mock(), size=10, interval=3600,
+                                 checkpoint=checkpoint)
+
+        def notify(comment, keywords):
+            if comment.id == 'c2':
+                raise ValueError('delivery failed')
+            digests.add('bboe', comment, keywords)
+
+        stream = [fake_comment('c0', 'praw'), fake_comment('c1', 'other'),
+                  fake_comment('c2', 'praw')]
+        pipeline = AlertPipeline(['praw'], notify, checkpoint=checkpoint)
+        with mock.patch('sys.stderr'):
+            pipeline.run(iter(stream))
+        # Interrupted while the digest of c0 is still buffered
+        checkpoint.save()
+        self.assertEqual([False, True, False], [
+            x.id in AlertCheckpoint(self.path, 'redditdev').seen
+            for x in stream])
+
+        digests.close()
+        checkpoint.save()
+        self.assertEqual([True, True, False], [
+            x.id in AlertCheckpoint(self.path, 'redditdev').seen
+            for x in stream])
+
+    def test_other_subreddit(self):
+        self.run_pipeline(self.stream[:3])
+        checkpoint = AlertCheckpoint(self.path, 'learnpython')
+        self.assertIsNone(checkpoint.last)
+        self.assertTrue(checkpoint.begin('c0'))
+
+    def test_seen_index(self):
+        index = SeenIndex(3)
+        for item in range(8):
+            index.add(item)
+        self.assertEqual([False] * 3 + [True] * 5,
+                         [item in index for item in range(8)])
+        index.add(8)
+        self.assertEqual(3, len(index))
+
+
+class DigestNotifierTest(unittest.TestCase):
+    def setUp(self):
+        """Setup runs before all test cases."""
+        self.reddit = mock.Mock()
+        self.comments = [CommentInfo('a', 'body', 'c{}'.format(i), 't3_sub',
+                                     'redditdev') for i in range(5)]
+
+    def messages(self):
+        return [call[0] for call in
+                self.reddit.redditor.return_value.message.call_args_list]
+
+    def test_format(self):
+        subject, body = DigestNotifier.format([
+            (self.comments[0], ['praw']),
+            (self.comments[1], ['bboe', 'praw'])])
+        self.assertEqual('Reddit Alert: 2 matches for praw, bboe', subject)
+        self.assertEqual(
+            '**praw** (2 matches)\n\n* {0} by /u/a\n* {1} by /u/a\n\n'
+            '**bboe** (1 match)\n\n* {1} by /u/a\n\n'.format(
+                quick_url(self.comments[0]), quick_url(self.comments[1])),
+            body)
+
+    def test_format_single(self):
+        self.assertEqual(
+            ('Reddit Alert: praw', '{}\n\nby /u/a\n\n---\n\nbody'.format(
+                quick_url(self.comments[0]))),
+            DigestNotifier.format([(self.comments[0], ['praw'])]))
+
+    def test_size_and_close(self):
+        notifier = DigestNotifier(self.reddit, size=2, interval=60)
+        for comment in self.comments:
+            notifier.add('user', comment, ['praw'])
+        notifier.close()
+        self.assertEqual(3, notifier.sent)
+        self.assertEqual(['Reddit Alert: 2 matches for praw'] * 2 +
+                         ['Reddit Alert: praw'],
+                         [subject for subject, _ in self.messages()])
+        self.reddit.redditor.assert_called_with('user')
+
+    def test_interval(self):
+        notifier = DigestNotifier(self.reddit, size=10, interval=0.05)
+        notifier.add('user', self.comments[0], ['praw'])
+        for _ in range(100):
+            if notifier.sent:
+                break
+            time.sleep(0.05)
+        self.assertEqual(1, notifier.sent)
+        self.assertEqual((0, 0), notifier.pending())
+        notifier.close()
+
+    def test_interval__busy_queue(self):
+        self.reddit.redditor.return_value.message.side_effect = (
+            lambda *args: time.sleep(0.02))
+        notifier = DigestNotifier(self.reddit, size=2, interval=0.1)
+        notifier.add('quiet', self.comments[0], ['praw'])
+        for _ in range(20):
+            notifier.add('busy', self.comments[0], ['praw'])
+            notifier.add('busy', self.comments[1], ['praw'])
+        while notifier.pending() != (0, 0):
+            time.sleep(0.01)
+        notifier.close()
+        recipients = [x[0][0] for x in self.reddit.redditor.call_args_list]
+        self.assertEqual(21, len(recipients))
+        self.assertLess(recipients.index('quiet'), 15)
+
+
+class MatcherTest(unittest.TestCase):
+    KEYWORDS = ['praw', 'reddit', 'reddit api', 'c++', 'api']
+    TEXTS = ['', 'PRAW', 'prawtools', 'use praw, reddit and the reddit API',
+             'The Reddit_API', 'c++ is not a keyword prefix in ac++',
+             'xapi api apix']
+
+    def test_automaton_matcher(self):
+        matcher = AutomatonMatcher(self.KEYWORDS)
+        self.assertEqual(
+            [[], ['praw'], [], ['praw', 'reddit', 'reddit api', 'api'],
+             ['reddit', 'api'], ['c++'], ['api']],
+            [matcher.find_all(text) for text in self.TEXTS])
+
+    def test_regex_matcher(self):
+        matcher = RegexMatcher(['praw', 'reddit api', 'reddit', 'c\\+\\+',
+                                'api'])
+        self.assertEqual(
+            [[], ['praw'], [], ['praw', 'reddit', 'reddit api'],
+             ['reddit', 'api'], ['c++'], ['api']],
+            [matcher.find_all(text) for text in self.TEXTS])
+
+
+class RuleSetTest(unittest.TestCase):
+    RULES = [{'name': 'dev', 'keywords': ['PRAW', 'reddit api'],
+              'subreddits': ['redditdev'], 'ignore_users': ['bot']},
+             {'keywords': ['praw', 'bboe'], 'message': 'bboe'}]
+
+    def setUp(self):
+        """Setup runs before all test cases."""
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'rules.json')
+        with open(self.path, 'w') as fp:
+            json.dump(self.RULES, fp)
+        self.rules = RuleSet(load_rules(self.path))
+
+    def tearDown(self):
+        """Teardown runs after all test cases."""
+        shutil.rmtree(self.directory)
+
+    def resolve(self, author, subreddit, keywords):
+        comment = CommentInfo(author, '', 'c0', 't3_sub', subreddit)
+        return [(rule.name, found) for rule, found
+                in self.rules.resolve(comment, keywords)]
+
+    def test_load_rules(self):
+        dev, other = self.rules.rules
+        self.assertEqual(('praw', 'reddit api'), dev.keywords)
+        self.assertIsNone(dev.message)
+        self.assertEqual(('rule2', 'bboe'), (other.name, other.message))
+        self.assertEqual(['bboe', 'praw', 'reddit api'], self.rules.keywords)
+        self.assertIsNone(self.rules.subreddits)
+
+    def test_load_rules_invalid(self):
+        for rule in ({'name': 'empty'}, {'keywords': 'praw'},
+                     {'keywords': ['praw', 1]},
+                     {'keywords': ['praw'], 'subreddits': 'redditdev'},
+                     {'keywords': ['praw'], 'ignore_users': 'bot'}):
+            with open(self.path, 'w') as fp:
+                json.dump([rule], fp)
+            self.assertRaises(ValueError, load_rules, self.path)
+
+    def test_resolve(self):
+        self.assertEqual(
+            [('dev', ['praw', 'reddit api']), ('rule2', ['praw'])],
+            self.resolve('a', 'RedditDev', ['praw', 'reddit api']))
+        self.assertEqual([('rule2', ['praw'])],
+                         self.resolve('Bot', 'redditdev', ['praw']))
+        self.assertEqual([('rule2', ['praw'])],
+                         self.resolve('a', 'python', ['praw', 'reddit api']))
+        self.assertEqual([], self.resolve(None, 'python', ['reddit api']))
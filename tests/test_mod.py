@@ -0,0 +1,262 @@
+"""Test modutils."""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+from praw.exceptions import APIException
+from six import StringIO
+from prawtools.helpers import external_sort
+from prawtools.mod import ModUtils, flair_template_plan
+from prawtools.snapshot import FlairSnapshots
+
+
+def fake_flair(user, text, css):
+    """Return a flair listing item as provided by PRAW."""
+    return {'flair_css_class': css, 'flair_text': text, 'user': user}
+
+
+class AddUsersTest(unittest.TestCase):
+    def setUp(self):
+        """Setup runs before all test cases."""
+        self.directory = tempfile.mkdtemp()
+        self.journal = os.path.join(self.directory, 'journal.jsonl')
+        self.names = os.path.join(self.directory, 'names.txt')
+        with open(self.names, 'w') as fp:
+            fp.write('alice, Bob\nbob carol-1\nmissing\nALICE dave\n')
+        self.modutils = ModUtils('redditdev')
+        self.modutils.sub = mock.MagicMock()
+        self.banned = self.modutils.sub.banned
+        self.banned.return_value = ['Carol-1']
+        self.banned.add.side_effect = self.add
+
+    def tearDown(self):
+        """Teardown runs after all test cases."""
+        shutil.rmtree(self.directory)
+
+    def add(self, name):
+        if name == 'missing':
+            raise APIException('USER_DOESNT_EXIST', 'no such user', 'name')
+
+    def add_users(self, workers):
+        with mock.patch('sys.stdout', new_callable=StringIO), \
+                mock.patch('sys.stderr', new_callable=StringIO):
+            return self.modutils.add_users('banned', self.names, workers,
+                                           self.journal)
+
+    def test_add_users(self):
+        counts = self.add_users(workers=4)
+        self.assertEqual({'added': 3, 'failed': 1, 'skipped': 1}, counts)
+        self.banned.assert_called_once_with(limit=None)
+        self.assertEqual({'alice', 'Bob', 'missing', 'dave'},
+                         {x[0][0] for x in self.banned.add.call_args_list})
+
+        self.banned.add.reset_mock()
+        counts = self.add_users(workers=1)
+        self.assertEqual({'failed': 1, 'resumed': 4}, counts)
+        self.banned.add.assert_called_once_with('missing')
+
+    @mock.patch('time.sleep')
+    def test_add_users__ratelimit(self, sleep_mock):
+        self.banned.add.side_effect = [
+            APIException('RATELIMIT', 'try again in 2 minutes.', None), None]
+        self.assertEqual(('alice', 'added', None),
+                         self.modutils._add_user(self.banned, 'alice'))
+        sleep_mock.assert_called_once_with(120)
+
+
+class FlairTemplateSyncTest(unittest.TestCase):
+    def setUp(self):
+        """Setup runs before all test cases."""
+        self.modutils = ModUtils('redditdev')
+        self.modutils.sub = mock.MagicMock()
+        self.modutils._current_flair = [
+            fake_flair('a', 'praw', 'blue'), fake_flair('b', 'praw', 'blue'),
+            fake_flair('c', 'bot', 'red'), fake_flair('d', 'bot', 'red'),
+            fake_flair('e', 'single', 'green')]
+        self.templates = self.modutils.sub.flair.templates
+
+    def sync(self, existing, **kwargs):
+        self.templates.__iter__.return_value = iter(existing)
+        options = dict(editable=False, limit=2, static=None, sort='alpha',
+                       use_css=True, use_text=True)
+        options.update(kwargs)
+        return self.modutils.flair_template_sync(**options)
+
+    def test_flair_template_plan(self):
+        existing = [{'id': '1', 'text': 'bot', 'css_class': 'red',
+                     'text_editable': True},
+                    {'id': '2', 'text': 'old', 'css_class': '',
+                     'text_editable': False},
+                    {'flair_template_id': '3', 'flair_text': 'bot',
+                     'flair_css_class': 'red', 'flair_text_editable': False}]
+        self.assertEqual(
+            [('delete', '2', 'old', ''), ('delete', '3', 'bot', 'red'),
+             ('update', '1', 'bot', 'red'), ('add', None, 'praw', 'blue')],
+            flair_template_plan(existing, [('bot', 'red'), ('praw', 'blue')],
+                                editable=False))
+
+    def test_flair_template_sync(self):
+        plan = self.sync([{'id': '1', 'text': 'gone', 'css_class': 'x',
+                           'text_editable': False}],
+                         static=['mod, green'])
+        self.assertEqual(4, len(plan))
+        self.templates.delete.assert_called_once_with('1')
+        self.assertEqual([mock.call('bot', 'red', False),
+                          mock.call('mod', 'green', False),
+                          mock.call('praw', 'blue', False)],
+                         self.templates.add.call_args_list)
+        self.templates.clear.assert_not_called()
+
+    def test_flair_template_sync__dry_run(self):
+        plan = self.sync([], dry_run=True)
+        self.assertEqual([('add', None, 'bot', 'red'),
+                          ('add', None, 'praw', 'blue')], plan)
+        self.assertEqual([], self.templates.method_calls)
+
+    def test_flair_template_sync__noop(self):
+        plan = self.sync([{'id': '1', 'text': 'bot', 'css_class': 'red',
+                           'text_editable': False},
+                          {'id': '2', 'text': 'praw', 'css_class': 'blue',
+                           'text_editable': False}])
+        self.assertEqual([], plan)
+        self.assertEqual([], self.templates.method_calls)
+
+
+class OutputFlairTest(unittest.TestCase):
+    def setUp(self):
+        """Setup runs before all test cases."""
+        self.modutils = ModUtils('redditdev')
+        self.modutils._current_flair = [
+            fake_flair('user{}'.format(i), 'text{}'.format(i % 7), None)
+            for i in range(30, 0, -1)]
+
+    def output(self, **kwargs):
+        with mock.patch('sys.stdout', new_callable=StringIO) as stdout:
+            self.modutils.output_current_flair(**kwargs)
+        return stdout.getvalue()
+
+    def test_external_sort(self):
+        items = [(i % 10, i) for i in range(95)]
+        expected = sorted(items, key=lambda x: x[0])
+        for buffer_size in (1, 10, 95, 1000):
+            self.assertEqual(expected, [tuple(x) for x in external_sort(
+                items, key=lambda x: x[0], buffer_size=buffer_size)])
+
+    def test_output_current_flair__json(self):
+        expected = [{'flair_css_class': x['flair_css_class'],
+                     'flair_text': x['flair_text'], 'user': x['user']}
+                    for x in self.modutils._current_flair]
+        self.assertEqual(expected, json.loads(self.output(as_json=True)))
+        self.assertEqual(expected, [json.loads(x) for x in self.output(
+            json_lines=True).splitlines()])
+        self.assertEqual(sorted(expected, key=lambda x: x['user']),
+                         json.loads(self.output(as_json=True, sort=True,
+                                                buffer_size=4)))
+        self.modutils._current_flair = []
+        self.assertEqual([], json.loads(self.output(as_json=True)))
+
+
+class UpdateFlairTest(unittest.TestCase):
+    def setUp(self):
+        """Setup runs before all test cases."""
+        self.modutils = ModUtils('redditdev')
+        self.modutils.sub = mock.MagicMock()
+        self.modutils.sub.flair.update.side_effect = self.update
+        self.batches = []
+
+    def update(self, rows):
+        self.batches.append(rows)
+        return [{'ok': row['user'] != 'bad', 'errors': {'user': 'invalid'}}
+                for row in rows]
+
+    def test_clear_empty(self):
+        self.modutils._current_flair = [
+            fake_flair('user{}'.format(i), None if i % 2 else 'text', None)
+            for i in range(500)]
+        self.assertEqual((250, []), self.modutils.clear_empty())
+        self.assertEqual([100, 100, 50], [len(x) for x in self.batches])
+        self.assertEqual({'flair_css_class': '', 'flair_text': '',
+                          'user': 'user1'}, self.batches[0][0])
+
+    def test_import_flair(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as fp:
+            fp.write('a,"say ""hi""",css\nbad,x\n\nc\n')
+            fp.flush()
+            result = self.modutils.import_flair(fp.name)
+        self.assertEqual((2, [('bad', {'user': 'invalid'})]), result)
+        self.assertEqual([{'flair_css_class': 'css',
+                           'flair_text': 'say ""hi""', 'user': 'a'},
+                          {'flair_css_class': '', 'flair_text': 'x',
+                           'user': 'bad'},
+                          {'flair_css_class': '', 'flair_text': '',
+                           'user': 'c'}], self.batches[0])
+
+
+class FlairSnapshotsTest(unittest.TestCase):
+    def setUp(self):
+        """Setup runs before all test cases."""
+        self.directory = tempfile.mkdtemp()
+        self.snapshots = FlairSnapshots(
+            os.path.join(self.directory, 'flair.sqlite'), keep=2)
+
+    def tearDown(self):
+        """Teardown runs after all test cases."""
+        self.snapshots.close()
+        shutil.rmtree(self.directory)
+
+    def modutils(self, flair, **kwargs):
+        modutils = ModUtils('redditdev', snapshots=self.snapshots, **kwargs)
+        modutils.sub = mock.MagicMock()
+        modutils.sub.__str__.return_value = 'redditdev'
+        modutils.sub.flair.__iter__.return_value = iter(flair)
+        return modutils
+
+    def test_current_flair__reuse(self):
+        flair = [fake_flair('b', 'text', None), fake_flair('a', '', 'css')]
+        self.assertEqual(flair, list(self.modutils(flair).current_flair()))
+        self.assertEqual(sorted(flair, key=lambda x: x['user']),
+                         list(self.modutils([]).current_flair()))
+        self.assertEqual([], list(self.modutils(
+            [], refresh=True).current_flair()))
+        self.assertEqual([], list(self.modutils(
+            flair, max_age=60).current_flair()))
+
+    def test_current_flair__live(self):
+        list(self.snapshots.record('redditdev', [
+            fake_flair('a', '', ''), fake_flair('b', '', '')], now=1))
+        modutils = self.modutils([fake_flair('a', 'set since', ''),
+                                  fake_flair('b', '', '')], max_age=None)
+        self.assertEqual(2, len(list(modutils.current_flair())))
+        modutils.sub.flair.update.return_value = [{'ok': True}]
+        with mock.patch('sys.stdout', new_callable=StringIO):
+            self.assertEqual((1, []), modutils.clear_empty())
+        modutils.sub.flair.update.assert_called_once_with([
+            {'flair_css_class': '', 'flair_text': '', 'user': 'b'}])
+
+    def test_record__incomplete(self):
+        flair = self.snapshots.record('redditdev', [fake_flair('a', 'x', '')])
+        next(flair)
+        self.assertIsNone(self.snapshots.latest('redditdev'))
+
+    def test_diff(self):
+        ids = []
+        for flair in ([fake_flair('a', 'x', ''), fake_flair('b', 'y', ''),
+                       fake_flair('c', 'z', None)],
+                      [fake_flair('b', 'y', 'new'), fake_flair('c', 'z', None),
+                       fake_flair('d', 'w', '')]):
+            list(self.snapshots.record('RedditDev', flair))
+            ids.append(self.snapshots.latest('redditdev'))
+        self.assertEqual([('a', ('x', ''), None),
+                          ('b', ('y', ''), ('y', 'new')),
+                          ('d', None, ('w', ''))],
+                         list(self.snapshots.diff(*ids)))
+
+    def test_record__prunes(self):
+        flair = [fake_flair('a', 'x', '')]
+        for _ in range(3):
+            list(self.snapshots.record('redditdev', flair))
+        self.assertEqual([(2, 1), (3, 1)], [
+            (x[0], x[2]) for x in self.snapshots.snapshots('redditdev')])
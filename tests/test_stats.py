@@ -1,10 +1,43 @@
 """Test subreddit_stats."""
+import gc
+import os
+import tempfile
+import threading
+import time
+import unittest
+import weakref
+
 import mock
-from prawtools.stats import SubredditStats
+from praw.models import Comment
+from prawcore.exceptions import NotFound, ResponseException
+from prawcore.rate_limit import RateLimiter
+from prawtools.cache import StatsCache
+from prawtools.dump import DumpWriter
+from prawtools.helpers import SharedRateLimiter
+from prawtools.profiling import StageProfiler
+from prawtools.stats import (AdaptiveCollector, ColumnarCommentStats,
+                             CommentStats, MiniComment, MiniSubmission,
+                             SubredditStats, _release_tree, numpy)
 
 from . import IntegrationTest
 
 
+def fake_submission(id, num_comments, created_utc=1466000000, score=1,
+                    author='author'):
+    """Return a mock that looks enough like a PRAW Submission."""
+    return mock.Mock(author=author, created_utc=created_utc,
+                     distinguished=None, id=id, num_comments=num_comments,
+                     permalink='/r/redditdev/comments/{}/_/'.format(id),
+                     score=score, title='Title {}'.format(id),
+                     url='https://example.com/{}'.format(id))
+
+
+def fake_comment(id, created_utc, score=1, author='author'):
+    """Return a mock that looks enough like a PRAW Comment."""
+    return mock.Mock(author=author, created_utc=created_utc,
+                     distinguished=None, id=id, score=score)
+
+
 class StatsTest(IntegrationTest):
     def setUp(self):
         """Setup runs before all test cases."""
@@ -17,8 +50,431 @@ class StatsTest(IntegrationTest):
             self.srs.fetch_recent_submissions(7)
             self.assertTrue(len(self.srs.submissions) > 1)
 
+    def test_recent__profile(self):
+        profiler = StageProfiler(memory=False)
+        profiler.attach(self.srs.reddit)
+        with self.recorder.use_cassette('StatsTest.recent'):
+            self.srs.max_date = 1466000000  # To work with current cassette
+            with profiler.stage('listing'):
+                self.srs.fetch_recent_submissions(7)
+        listing = profiler.report()['stages'][0]
+        self.assertEqual('listing', listing['name'])
+        self.assertTrue(listing['requests'] > 0)
+        self.assertTrue(listing['bytes'] > 0)
+        self.assertIsNone(listing['peak_bytes'])
+
     @mock.patch('time.sleep', return_value=None)
     def test_top(self, _sleep_mock):
         with self.recorder.use_cassette('StatsTest.top'):
             self.srs.fetch_top_submissions('week')
             self.assertTrue(len(self.srs.submissions) > 1)
+
+
+class ProcessCommentersTest(unittest.TestCase):
+    def setUp(self):
+        """Setup runs before all test cases."""
+        self.srs = SubredditStats('redditdev', None, None)
+        self.trees = {}
+        for i in range(20):
+            sub_id = 's{}'.format(i)
+            self.trees[sub_id] = [
+                fake_comment('{}c{}'.format(sub_id, j), 1466000000 + j % 7,
+                             score=j, author='user{}'.format(j % 3))
+                for j in range(i % 4)]
+            self.srs.submissions[sub_id] = MiniSubmission(
+                fake_submission(sub_id, len(self.trees[sub_id])))
+
+    def fake_reddit_submission(self, id):
+        submission = mock.Mock()
+        submission.comments.list.return_value = self.trees[id]
+        return submission
+
+    def process(self, workers):
+        self.srs.comment_stats = CommentStats()
+        self.srs.workers = workers
+        with mock.patch.object(self.srs.reddit, 'submission',
+                               side_effect=self.fake_reddit_submission):
+            self.srs.process_commenters()
+        stats = self.srs.comment_stats
+        return (stats.authors, stats.count, stats.first, stats.last,
+                stats.score, [comment.id for _, comment in stats.top])
+
+    def test_process_commenters__workers_match_serial(self):
+        serial = self.process(1)
+        self.assertEqual(sum(len(x) for x in self.trees.values()), serial[1])
+        self.assertEqual(serial, self.process(4))
+
+    @unittest.skipIf(numpy is None, 'requires numpy')
+    def test_process_commenters__columnar(self):
+        expected = self.process(1)
+        self.srs.comment_stats = ColumnarCommentStats()
+        with mock.patch.object(self.srs.reddit, 'submission',
+                               side_effect=self.fake_reddit_submission):
+            self.srs.process_commenters()
+        stats = self.srs.comment_stats
+        self.assertEqual(expected[0], stats.to_dict()['authors'])
+        self.assertEqual(expected[1:], (
+            stats.count, stats.first, stats.last, stats.score,
+            [comment.id for _, comment in stats.top]))
+        self.assertEqual(CommentStats.top_authors(self.srs.comment_stats, 2),
+                         stats.top_authors(2))
+
+    def test_fetch_comment_tree__too_many_requests(self):
+        submission = self.fake_reddit_submission('s3')
+        submission.comments.replace_more.side_effect = [
+            ResponseException(mock.Mock(status_code=429)), None]
+        with mock.patch.object(self.srs.reddit, 'submission',
+                               return_value=submission):
+            self.assertEqual(self.trees['s3'], self.srs._fetch_comment_tree(
+                self.srs.submissions['s3']))
+            submission.comments.replace_more.side_effect = NotFound(
+                mock.Mock(status_code=404))
+            self.assertRaises(NotFound, self.srs._fetch_comment_tree,
+                              self.srs.submissions['s3'])
+
+    def test_process_commenters__profile(self):
+        self.srs.profiler = profiler = StageProfiler()
+        self.addCleanup(profiler.close)
+        self.process(2)
+        stages = {x['name']: x for x in profiler.report()['stages']}
+        self.assertEqual(['comments', 'replace_more', 'aggregate'],
+                         [x['name'] for x in profiler.report()['stages']])
+        self.assertEqual(15, stages['replace_more']['calls'])
+        self.assertEqual(15, stages['aggregate']['calls'])
+        self.assertTrue(stages['comments']['peak_bytes'] >=
+                        stages['aggregate']['peak_bytes'] > 0)
+        self.assertTrue(stages['comments']['seconds'] >=
+                        stages['aggregate']['seconds'])
+
+    def test_adaptive_collector(self):
+        sizes = [100, 150, 164, 100, 130]
+        with mock.patch('prawtools.stats._resident_size',
+                        side_effect=lambda: sizes.pop(0)):
+            collector = AdaptiveCollector(threshold=64)
+            self.assertFalse(collector.due())
+            self.assertTrue(collector.due())
+            collector.collect()
+            self.assertFalse(collector.due())
+        self.assertEqual(1, collector.collections)
+        with mock.patch('prawtools.stats._resident_size', return_value=None):
+            self.assertFalse(AdaptiveCollector().due())
+
+    def test_release_tree(self):
+        submission = self.srs.reddit.submission(id='s0')
+        comments = [Comment(self.srs.reddit, _data={
+            'author': 'author', 'id': 'c{}'.format(i),
+            'name': 't1_c{}'.format(i)}) for i in range(2)]
+        for comment in comments:
+            comment.submission = submission
+        references = [weakref.ref(x) for x in [submission] + comments]
+        gc.disable()
+        self.addCleanup(gc.enable)
+        _release_tree(comments)
+        del comment, comments, submission
+        self.assertEqual([None] * 3, [x() for x in references])
+
+    def test_process_commenters__cache(self):
+        self.srs.cache = StatsCache(':memory:', ttl=60, settled_age=86400)
+        expected = self.process(1)
+        self.trees = {}  # Any refetch will now fail
+        self.assertEqual(expected, self.process(4))
+
+    def test_load_dump(self):
+        fd, path = tempfile.mkstemp('.jsonl.gz')
+        os.close(fd)
+        self.srs.dump = DumpWriter(path, {'max_date': 1466000000 + 3600,
+                                          'subreddit': 'redditdev'})
+        with mock.patch.object(self.srs.reddit, 'submission',
+                               side_effect=self.fake_reddit_submission):
+            self.srs.fetch_submissions(lambda: None)
+        self.srs.dump.close()
+
+        self.addCleanup(os.remove, path)
+        for columnar in (False, True) if numpy else (False,):
+            replay = SubredditStats('redditdev', None, None,
+                                    columnar=columnar)
+            replay.load_dump(path, '1')
+            self.assertEqual(self.srs.basic_stats(), replay.basic_stats())
+            self.assertEqual(self.srs.top_comments(), replay.top_comments())
+            self.assertEqual(self.srs.top_submitters(10),
+                             replay.top_submitters(10))
+
+    def test_stats_cache__staleness(self):
+        cache = StatsCache(':memory:', ttl=60, settled_age=86400)
+        fresh, settled = [MiniSubmission(fake_submission(x, 1, 1000000))
+                          for x in ('fresh', 'settled')]
+        cache.store_comments(fresh, [fake_comment('a', 1000000)],
+                             fetched_at=1000000)
+        cache.store_comments(settled, [fake_comment('b', 1000000)],
+                             fetched_at=1000000 + 86400)
+        self.assertEqual(1, len(cache.comments(fresh, now=1000059)))
+        self.assertIsNone(cache.comments(fresh, now=1000060))
+        self.assertEqual('b', cache.comments(settled, now=2e9)[0].id)
+
+    def test_comment_stats__matches_sorted_order(self):
+        submission = MiniSubmission(fake_submission('s', 4))
+        comments = [MiniComment(fake_comment(id, created, score, author),
+                                submission)
+                    for id, created, score, author in [
+                        ('a', 30, 5, 'x'), ('b', 10, 5, 'x'),
+                        ('c', 20, 5, None), ('d', 10, 7, 'y'),
+                        ('e', 10, 5, 'x')]]
+        stats = CommentStats(top=3)
+        for comment in comments:
+            stats.add(comment)
+        self.assertEqual(['d', 'c', 'b'],
+                         [comment.id for _, comment in stats.top])
+        self.assertEqual({'x': [3, 15, 10, 30], 'y': [1, 7, 10, 10]},
+                         stats.authors)
+        self.assertEqual((5, 27, 10, 30),
+                         (stats.count, stats.score, stats.first, stats.last))
+
+
+class FakeListing(object):
+    """A listing backend over a list of submissions."""
+
+    limit = 5
+
+    def __init__(self, submissions):
+        """Initialize a FakeListing."""
+        self.calls = []
+        self.submissions = submissions
+
+    def fetch(self, start, end):
+        """Return up to ``limit`` of the newest submissions in the range."""
+        self.calls.append((start, end))
+        return [x for x in self.submissions
+                if start <= x.created_utc <= end][-self.limit:]
+
+
+class SharedRateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        """Setup runs before all test cases."""
+        self.limiter = RateLimiter()
+        self.limiter.remaining = 2
+        self.limiter.reset_timestamp = time.time() + 1000
+        self.shared = SharedRateLimiter(self.limiter)
+        self.sent = []
+        self.release = threading.Event()
+
+    def request(self, headers):
+        self.sent.append(headers)
+        self.release.wait(5)
+        return mock.Mock(headers={'x-ratelimit-remaining': '0',
+                                  'x-ratelimit-reset': '1000',
+                                  'x-ratelimit-used': '600'})
+
+    @mock.patch('prawcore.rate_limit.time.sleep')
+    def test_call__concurrent(self, sleep_mock):
+        threads = [threading.Thread(target=self.shared.call,
+                                    args=(self.request, dict))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        while len(self.sent) < 4:
+            time.sleep(0.01)
+        self.assertEqual(4, self.shared.in_flight)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(0, self.shared.in_flight)
+        # Every request but the first waited, and once the budget was spent
+        # the remaining requests waited for the ratelimit to reset.
+        sleeps = [x[0][0] for x in sleep_mock.call_args_list]
+        self.assertEqual(3, len(sleeps))
+        self.assertTrue(sleeps[0] > 5)
+        self.assertTrue(all(x > 900 for x in sleeps[1:]))
+
+
+class SlicedListingTest(unittest.TestCase):
+    def test_fetch_sliced_submissions(self):
+        submissions = [fake_submission('s{}'.format(i), 0, 1000 + i * 10)
+                       for i in range(30)]
+        listing = FakeListing(submissions)
+        srs = SubredditStats('redditdev', None, None, slices=4, workers=3,
+                             listing=listing)
+        srs.min_date, srs.max_date = 1000, 1300
+        srs.fetch_sliced_submissions(None)
+        self.assertEqual(sorted(x.id for x in submissions[1:]),
+                         sorted(srs.submissions))
+        self.assertEqual(
+            [(1000, 1075), (1075, 1150), (1150, 1225), (1225, 1300)],
+            listing.calls[:4])
+        self.assertEqual(12, len(listing.calls))
+
+    def test_fetch_sliced_submissions__unsupported(self):
+        srs = SubredditStats('redditdev', None, None, slices=4,
+                             listing=FakeListing([]))
+        srs.min_date, srs.max_date = 1000, 1300
+        with mock.patch('prawtools.stats.logger.warning') as warning:
+            srs.fetch_sliced_submissions(None)
+        self.assertIn('Every time slice was empty', warning.call_args[0][0])
+
+        # A listing ignoring the bounds must not be split indefinitely
+        srs.listing.fetch = lambda start, end: [
+            fake_submission('s{}'.format(i), 0, 1000 + i) for i in range(5)]
+        self.assertRaises(RuntimeError, srs.fetch_sliced_submissions, None)
+
+
+class HydrationTest(unittest.TestCase):
+    def setUp(self):
+        """Setup runs before all test cases."""
+        self.srs = SubredditStats('redditdev', None, None)
+        self.srs.cache = StatsCache(':memory:', ttl=60, settled_age=86400)
+        self.calls = []
+
+    def info(self, fullnames):
+        self.calls.append(len(fullnames))
+        return [fake_submission(x[3:], 7, score=42) for x in fullnames]
+
+    def test_fetch_submission_ids(self):
+        now = time.time()
+        self.srs.cache.store_submissions(
+            [MiniSubmission(fake_submission('fresh', 1, now))], now)
+        self.srs.cache.store_submissions(
+            [MiniSubmission(fake_submission('stale', 1, now))], now - 61)
+        ids = ['fresh', 'stale'] + ['s{}'.format(i) for i in range(150)]
+        with mock.patch.object(self.srs.reddit, 'info',
+                               side_effect=self.info):
+            self.srs.fetch_submission_ids(ids + ['s0'])
+        self.assertEqual([1, 100, 50], self.calls)
+        self.assertEqual(sorted(ids), sorted(self.srs.submissions))
+        self.assertEqual((1, 1), (self.srs.submissions['fresh'].score,
+                                  self.srs.submissions['fresh'].num_comments))
+        self.assertEqual((42, 7), (self.srs.submissions['stale'].score,
+                                   self.srs.submissions['stale'].num_comments))
+
+    @mock.patch.object(SubredditStats, 'process_commenters')
+    @mock.patch.object(SubredditStats, 'process_submitters')
+    def test_fetch_submissions__reused_become_stale(self, *_):
+        now = time.time()
+        self.srs.cache.store_submissions(
+            [MiniSubmission(fake_submission('fresh', 1, now))], now - 40)
+        with mock.patch.object(self.srs.reddit, 'info',
+                               side_effect=self.info):
+            self.srs.fetch_submissions(self.srs.fetch_submission_ids,
+                                       ['fresh', 'new'])
+        self.assertEqual([1], self.calls)
+        cached = self.srs.cache.submissions(['fresh', 'new'], now=now + 30)
+        self.assertEqual({'fresh': False, 'new': True},
+                         {x: fresh for x, (fresh, _) in cached.items()})
+
+    def test_reuse_unchanged(self):
+        self.srs.cache.reuse_unchanged = True
+        submission = MiniSubmission(fake_submission('s', 1, 1000000))
+        self.srs.cache.store_comments(
+            submission, [fake_comment('a', 1000000)], fetched_at=1000000)
+        self.assertEqual(1, len(self.srs.cache.comments(submission, now=2e9)))
+        submission.num_comments = 2
+        self.assertIsNone(self.srs.cache.comments(submission, now=2e9))
+
+
+class IncrementalTest(unittest.TestCase):
+    DAY = 86400
+    START = 1466035200  # Midnight UTC
+
+    def setUp(self):
+        """Setup runs before all test cases."""
+        self.listing = []
+        self.trees = {}
+        for i in range(40):
+            sub_id = 's{}'.format(i)
+            created = self.START + i * self.DAY // 4
+            self.trees[sub_id] = [
+                fake_comment('{}c{}'.format(sub_id, j), created + j,
+                             score=i % 5, author='user{}'.format(j % 3))
+                for j in range(i % 3)]
+            self.listing.insert(0, fake_submission(
+                sub_id, len(self.trees[sub_id]), created,
+                author='user{}'.format(i % 4)))
+        fd, self.state_path = tempfile.mkstemp('.json')
+        os.close(fd)
+        os.remove(self.state_path)
+
+    def tearDown(self):
+        """Run after all test cases."""
+        if os.path.isfile(self.state_path):
+            os.remove(self.state_path)
+
+    def run_stats(self, day, state_path):
+        srs = SubredditStats('redditdev', None, None)
+        srs.max_date = self.START + day * self.DAY + 3600
+        fetched = []
+
+        def fake_reddit_submission(id):
+            fetched.append(id)
+            submission = mock.Mock()
+            submission.comments.list.return_value = self.trees[id]
+            return submission
+
+        with mock.patch.object(srs.reddit, 'submission',
+                               side_effect=fake_reddit_submission):
+            with mock.patch.object(srs.subreddit, 'new',
+                                   return_value=iter(self.listing)):
+                srs.fetch_incremental(3, state_path)
+        report = (srs.basic_stats() + srs.top_submitters(10) +
+                  srs.top_commenters(10) + srs.top_submissions() +
+                  srs.top_comments())
+        return report, fetched
+
+    def test_fetch_incremental(self):
+        _, fetched = self.run_stats(5, self.state_path)
+        self.assertEqual(8, len(fetched))
+        report, fetched = self.run_stats(6, self.state_path)
+        self.assertEqual(['s23', 's22', 's20'], fetched)
+        self.assertEqual(self.run_stats(6, self.state_path + '.new')[0],
+                         report)
+        os.remove(self.state_path + '.new')
+
+    def test_fetch_incremental__interrupted_write(self):
+        self.run_stats(5, self.state_path)
+        with open(self.state_path) as fp:
+            state = fp.read()
+        with mock.patch('prawtools.stats.json.dump', side_effect=IOError):
+            self.assertRaises(IOError, self.run_stats, 6, self.state_path)
+        os.remove(self.state_path + '.tmp')
+        with open(self.state_path) as fp:
+            self.assertEqual(state, fp.read())
+
+
+class RunManyTest(unittest.TestCase):
+    def test_run_many__isolates_failures(self):
+        reddit = SubredditStats('redditdev', None, None).reddit
+
+        def fake_run(srs, view, submitters, commenters, **kwargs):
+            if str(srs.subreddit) == 'bad':
+                raise ValueError('bad subreddit')
+            self.assertIs(reddit, srs.reddit)
+            return str(srs.subreddit)
+
+        with mock.patch.object(SubredditStats, 'run', autospec=True,
+                               side_effect=fake_run):
+            results = SubredditStats.run_many(['a', 'bad', 'c'], '7', 10, 10,
+                                              reddit, pool_size=2)
+        self.assertEqual([('a', 'a'), ('c', 'c')],
+                         [results[0], results[2]])
+        self.assertIsInstance(results[1][1], ValueError)
+
+
+class PublishResultsTest(unittest.TestCase):
+    def test_publish_results__fits_most_submitters(self):
+        srs = SubredditStats('redditdev', None, None)
+        for i in range(600):
+            submission = MiniSubmission(fake_submission(
+                's{}'.format(i), 0, score=i % 7,
+                author='user{}'.format(i % 200)))
+            submission.title = 'T' * (i % 150)
+            srs.submissions[submission.id] = submission
+        srs.process_submitters()
+        with mock.patch.object(srs.submit_subreddit, 'submit') as submit:
+            srs.publish_results('7', 150, 10)
+        body = submit.call_args[1]['selftext']
+
+        basic = srs.basic_stats()
+        others = (srs.top_commenters(10) + srs.top_submissions() +
+                  srs.top_comments() + srs.post_footer)
+        fitting = [num for num in range(1, 151) if len(
+            basic + srs.top_submitters(num) + others) <= 40000]
+        self.assertTrue(0 < len(fitting) < 150)
+        self.assertEqual(basic + srs.top_submitters(fitting[-1]) + others,
+                         body)